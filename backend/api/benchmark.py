@@ -0,0 +1,410 @@
+""" Нагрузочный прогон API: генерация данных, маршруты и бюджеты запросов.
+"""
+import base64
+import io
+import random
+import statistics
+import time
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from recipes.models import (AmountOfIngredient, Favourite, Ingredient, Recipe,
+                            ShoppingList, Tag)
+from users.models import Subscribe, User
+
+# Без «ё»: она не входит в диапазон а-я валидатора названий.
+LETTERS = 'абвгдежзийклмнопрстуфхцчшщэюя'
+
+# PNG 1x1, чтобы создание рецепта проходило через декодирование картинки.
+PIXEL = base64.b64encode(
+    b'\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR\x00\x00\x00\x01\x00\x00\x00\x01'
+    b'\x08\x02\x00\x00\x00\x90wS\xde\x00\x00\x00\x0cIDATx\x9cc\xf8\xcf'
+    b'\xc0\x00\x00\x03\x01\x01\x00\xc9\xfe\x92\xef\x00\x00\x00\x00IEND'
+    b'\xaeB`\x82'
+).decode()
+IMAGE = f'data:image/png;base64,{PIXEL}'
+
+
+def word(number):
+    """ Буквенное имя для числа: валидаторы моделей не допускают цифр. """
+    letters = []
+    while True:
+        number, rest = divmod(number, len(LETTERS))
+        letters.append(LETTERS[rest])
+        if not number:
+            return ''.join(reversed(letters))
+
+
+def generate_users(count):
+    for number in range(count):
+        yield User(
+            username=f'user{number}',
+            email=f'user{number}@foodgram.ru',
+            first_name=f'Имя {word(number)}',
+            last_name=f'Фамилия {word(number)}',
+        )
+
+
+def generate_recipes(authors, per_author, rnd):
+    number = 0
+    for author in authors:
+        for _ in range(per_author):
+            number += 1
+            yield Recipe(
+                author=author,
+                name=f'рецепт {word(number)}',
+                text=f'Описание рецепта {word(number)}',
+                cooking_time=rnd.randint(1, 180),
+            )
+
+
+def generate_amounts(recipes, ingredients, per_recipe, rnd):
+    for recipe in recipes:
+        for ingredient in rnd.sample(ingredients, per_recipe):
+            yield AmountOfIngredient(
+                recipe=recipe,
+                ingredient=ingredient,
+                amount=rnd.randint(1, 1000),
+            )
+
+
+def seed_dataset(users=30, recipes_per_user=20, ingredients=300, tags=5,
+                 ingredients_per_recipe=8, follows=10, favourites_per_user=0,
+                 seed=0):
+    """ Наполняет базу согласованным набором данных.
+    Возвращает пользователя, от имени которого выполняются запросы:
+    у него есть избранное, список покупок и подписки. Остальные
+    пользователи добавляют по favourites_per_user рецептов в избранное
+    и половину из них — в список покупок.
+    """
+    rnd = random.Random(seed)
+    User.objects.bulk_create(generate_users(users), batch_size=500)
+    authors = list(User.objects.order_by('id'))
+    Tag.objects.bulk_create(
+        Tag(name=f'тег {word(number)}', color=f'#{number:06x}',
+            slug=f'tag{number}')
+        for number in range(tags)
+    )
+    all_tags = list(Tag.objects.all())
+    Ingredient.objects.bulk_create(
+        (Ingredient(name=f'ингредиент {word(number)}', measurement_unit='г')
+         for number in range(ingredients)),
+        batch_size=500,
+    )
+    all_ingredients = list(Ingredient.objects.all())
+    Recipe.objects.bulk_create(
+        generate_recipes(authors, recipes_per_user, rnd), batch_size=500
+    )
+    recipes = list(Recipe.objects.order_by('id'))
+    AmountOfIngredient.objects.bulk_create(
+        generate_amounts(
+            recipes, all_ingredients, ingredients_per_recipe, rnd
+        ),
+        batch_size=500,
+    )
+    Recipe.tags.through.objects.bulk_create(
+        Recipe.tags.through(recipe=recipe, tag=tag)
+        for recipe in recipes
+        for tag in rnd.sample(all_tags, rnd.randint(1, len(all_tags)))
+    )
+    viewer = authors[0]
+    chosen = rnd.sample(recipes, min(len(recipes), 50))
+    Favourite.objects.bulk_create(
+        Favourite(user=viewer, recipe=recipe) for recipe in chosen
+    )
+    ShoppingList.objects.bulk_create(
+        ShoppingList(user=viewer, recipe=recipe) for recipe in chosen[:10]
+    )
+    Subscribe.objects.bulk_create(
+        Subscribe(subscriber=viewer, subscribing=author)
+        for author in authors[1:follows + 1]
+    )
+    others = {
+        user: rnd.sample(recipes, min(len(recipes), favourites_per_user))
+        for user in authors[1:]
+    }
+    Favourite.objects.bulk_create(
+        (Favourite(user=user, recipe=recipe)
+         for user, chosen in others.items() for recipe in chosen),
+        batch_size=500,
+    )
+    ShoppingList.objects.bulk_create(
+        (ShoppingList(user=user, recipe=recipe)
+         for user, chosen in others.items()
+         for recipe in chosen[:favourites_per_user // 2]),
+        batch_size=500,
+    )
+    call_command('rebuild_counters', stdout=io.StringIO())
+    call_command('rebuild_shopping_cart', stdout=io.StringIO())
+    call_command('build_similar_recipes', stdout=io.StringIO())
+    call_command('update_trending', stdout=io.StringIO())
+    return viewer
+
+
+@dataclass
+class Route:
+    """ Маршрут API с бюджетом запросов к базе данных. """
+    name: str
+    method: str
+    path: Callable
+    budget: int
+    status: int = 200
+    data: Optional[Callable] = None
+    headers: Optional[Callable] = None
+    paginated: bool = False
+    # Проверка данных после маршрута записи: False — ошибка прогона.
+    check: Optional[Callable] = None
+
+
+class State:
+    """ Объекты, между которыми ходят запросы прогона. """
+
+    def __init__(self, viewer):
+        self.viewer = viewer
+        self.created = 0
+        # Последний ETag, полученный по каждому пути.
+        self.etags = {}
+        self.recipe = Recipe.objects.exclude(author=viewer).exclude(
+            favourites__user=viewer
+        ).exclude(shopping_list__user=viewer).first()
+        self.author = User.objects.exclude(
+            subscribing__subscriber=viewer
+        ).exclude(pk=viewer.pk).first()
+        self.ingredients = list(
+            Ingredient.objects.values_list('id', flat=True)[:20]
+        )
+        self.tags = list(Tag.objects.values_list('id', flat=True)[:2])
+
+    def recipe_payload(self):
+        self.created += 1
+        return {
+            'name': f'новый рецепт {word(self.created)}',
+            'text': 'Описание',
+            'cooking_time': 15,
+            'image': IMAGE,
+            'tags': self.tags,
+            'ingredients': [
+                # Количества меняются от пакета к пакету, чтобы
+                # обновление рецепта меняло суммы списков покупок.
+                {'id': ingredient, 'amount': 10 + number + self.created}
+                for number, ingredient in enumerate(self.ingredients)
+            ],
+        }
+
+    def batch_payload(self, size=10):
+        return [self.recipe_payload() for _ in range(size)]
+
+    def pantry_path(self):
+        """ Рецепты из ингредиентов self.recipe и ещё десятка других,
+        которым не хватает не больше одного ингредиента.
+        """
+        available = set(self.ingredients[:10]) | set(
+            self.recipe.ingredients.values_list('ingredient_id', flat=True)
+        )
+        excluded = next(
+            pk for pk in self.ingredients if pk not in available
+        )
+        return (
+            f'/api/recipes/?ingredients_available='
+            f'{",".join(str(pk) for pk in sorted(available))}'
+            f'&missing_max=1&ingredients_none={excluded}'
+        )
+
+    def created_recipe(self):
+        return Recipe.objects.filter(author=self.viewer).first()
+
+
+def shopping_cart_consistent(state):
+    """ Суммы списков покупок совпадают с пересчитанными заново. """
+    try:
+        call_command(
+            'rebuild_shopping_cart', verify=True, stdout=io.StringIO()
+        )
+    except CommandError:
+        return False
+    return True
+
+
+def not_modified(state, path):
+    """ Условный запрос с последним полученным ETag этого пути. """
+    return {'HTTP_IF_NONE_MATCH': state.etags[path]}
+
+
+ROUTES = (
+    # Первый запрос загружает кэш флагов пользователя: +3 запроса.
+    Route('recipes-list', 'get', lambda s: '/api/recipes/', 7,
+          paginated=True),
+    Route('recipes-list-cursor', 'get',
+          lambda s: '/api/recipes/?pagination=cursor', 3, paginated=True),
+    Route('recipes-list-filtered', 'get',
+          lambda s: '/api/recipes/?is_favorited=1&tags=tag0&tags=tag1', 5,
+          paginated=True),
+    # Полнотекстовый поиск идёт тем же запросом страницы, что и список.
+    Route('recipes-search', 'get',
+          lambda s: '/api/recipes/?search=рецепт', 4, paginated=True),
+    # Множества рецептов по ингредиентам, их число и срез страницы
+    # считаются в памяти, без COUNT: рецепты страницы с тегами и
+    # ингредиентами — 3 запроса; индекс строится при первом: +2.
+    Route('recipes-by-ingredients', 'get',
+          lambda s: s.pantry_path(), 5, paginated=True),
+    # Как список с фильтром по тегу: проверка слага тега +1 запрос;
+    # время последнего пересчёта популярности для ETag: +1 запрос.
+    Route('recipes-trending', 'get',
+          lambda s: '/api/recipes/trending/?tags=tag0', 6, paginated=True),
+    # Id страницы одним запросом, рецепты с тегами и ингредиентами: +3.
+    Route('recipes-feed', 'get', lambda s: '/api/recipes/feed/', 4,
+          paginated=True),
+    Route('recipes-list-not-modified', 'get', lambda s: '/api/recipes/', 0,
+          status=304, paginated=True,
+          headers=not_modified),
+    # Время изменения рецепта для ETag: +1 запрос.
+    Route('recipes-detail', 'get', lambda s: f'/api/recipes/{s.recipe.id}/',
+          4),
+    Route('recipes-detail-not-modified', 'get',
+          lambda s: f'/api/recipes/{s.recipe.id}/', 1, status=304,
+          headers=not_modified),
+    Route('recipes-similar', 'get',
+          lambda s: f'/api/recipes/{s.recipe.id}/similar/', 1),
+    Route('recipes-create', 'post', lambda s: '/api/recipes/', 13,
+          status=201, data=lambda s: s.recipe_payload()),
+    # Пакет из 10 рецептов: число запросов не зависит от размера пакета.
+    Route('recipes-batch', 'post', lambda s: '/api/recipes/batch/', 12,
+          status=201, data=lambda s: s.batch_payload()),
+    # Свой рецепт в списке покупок: обновление и удаление рецепта
+    # должны перенести изменения в суммы ингредиентов.
+    Route('shopping-cart-add-own', 'post',
+          lambda s: f'/api/recipes/{s.created_recipe().id}/shopping_cart/',
+          9, status=201, check=shopping_cart_consistent),
+    # Рецепт в списке покупок: блокировка рецепта и пересчёт сумм
+    # ингредиентов +4 запроса. Запись списка покупок удалила множества
+    # id зрителя из кэша, ответ загружает их заново: +3 запроса.
+    Route('recipes-update', 'patch',
+          lambda s: f'/api/recipes/{s.created_recipe().id}/', 22,
+          data=lambda s: s.recipe_payload(), check=shopping_cart_consistent),
+    Route('favorite-add', 'post',
+          lambda s: f'/api/recipes/{s.recipe.id}/favorite/', 6, status=201),
+    # Удаление с сигналами сначала выбирает удаляемые строки: +1 запрос.
+    Route('favorite-remove', 'delete',
+          lambda s: f'/api/recipes/{s.recipe.id}/favorite/', 6, status=204),
+    # Суммы ингредиентов списка покупок обновляются при записи под
+    # блокировкой рецепта: выгрузка читает их одним запросом.
+    Route('shopping-cart-add', 'post',
+          lambda s: f'/api/recipes/{s.recipe.id}/shopping_cart/', 9,
+          status=201),
+    Route('shopping-cart-remove', 'delete',
+          lambda s: f'/api/recipes/{s.recipe.id}/shopping_cart/', 9,
+          status=204, check=shopping_cart_consistent),
+    Route('download-shopping-cart', 'get',
+          lambda s: '/api/recipes/download_shopping_cart/', 1),
+    Route('download-shopping-cart-csv', 'get',
+          lambda s: '/api/recipes/download_shopping_cart/?format=csv', 1),
+    # PDF рисуется один раз на версию корзины — хэш готовых сумм,
+    # прочитанных одним запросом, — затем берётся из кэша.
+    Route('download-shopping-cart-pdf', 'get',
+          lambda s: '/api/recipes/download_shopping_cart/?format=pdf', 1),
+    # Проверка, ссылаются ли другие рецепты на изображение: +1 запрос;
+    # каскадное удаление похожих рецептов и популярности: +2 запроса;
+    # рецепт в списке покупок: блокировка рецепта и вычитание его
+    # ингредиентов +4 запроса.
+    Route('recipes-delete', 'delete',
+          lambda s: f'/api/recipes/{s.created_recipe().id}/', 19,
+          status=204, check=shopping_cart_consistent),
+    Route('ingredients-list', 'get', lambda s: '/api/ingredients/', 1),
+    Route('ingredients-list-not-modified', 'get',
+          lambda s: '/api/ingredients/', 0, status=304,
+          headers=not_modified),
+    # Названия ингредиентов загружаются при первом поиске, частоты
+    # ингредиентов в рецептах — при первом поиске похожих. Похожие
+    # ищутся в памяти в любой БД, так что бюджеты от БД не зависят.
+    Route('ingredients-search', 'get',
+          lambda s: '/api/ingredients/?name=ингредиент', 1),
+    Route('ingredients-search-fuzzy', 'get',
+          lambda s: '/api/ingredients/?name=ингридиетн', 1),
+    Route('ingredients-detail', 'get',
+          lambda s: f'/api/ingredients/{s.ingredients[0]}/', 1),
+    Route('tags-list', 'get', lambda s: '/api/tags/', 1),
+    Route('tags-list-not-modified', 'get', lambda s: '/api/tags/', 0,
+          status=304,
+          headers=not_modified),
+    Route('tags-detail', 'get', lambda s: f'/api/tags/{s.tags[0]}/', 1),
+    Route('users-list', 'get', lambda s: '/api/users/', 5, paginated=True),
+    Route('users-detail', 'get', lambda s: f'/api/users/{s.author.id}/', 4),
+    Route('users-me', 'get', lambda s: '/api/users/me/', 1),
+    Route('subscriptions', 'get',
+          lambda s: '/api/users/subscriptions/?recipes_limit=3', 3,
+          paginated=True),
+    Route('subscriptions-cursor', 'get',
+          lambda s: '/api/users/subscriptions/?pagination=cursor'
+                    '&recipes_limit=3', 2, paginated=True),
+    # Ответ загружает заново множества id, удалённые записью: +3.
+    Route('subscribe', 'post',
+          lambda s: f'/api/users/{s.author.id}/subscribe/?recipes_limit=3',
+          11, status=201),
+    Route('unsubscribe', 'delete',
+          lambda s: f'/api/users/{s.author.id}/subscribe/', 5, status=204),
+)
+
+
+def paged(path, page_size):
+    separator = '&' if '?' in path else '?'
+    return f'{path}{separator}limit={page_size}'
+
+
+def measure(client, route, state, page_size, repeat):
+    """ Выполняет маршрут repeat раз и возвращает строку отчёта. """
+    timings, queries, statuses = [], 0, set()
+    for _ in range(repeat):
+        path = route.path(state)
+        if route.paginated:
+            path = paged(path, page_size)
+        data = route.data(state) if route.data else None
+        headers = route.headers(state, path) if route.headers else {}
+        with CaptureQueriesContext(connection) as context:
+            started = time.perf_counter()
+            response = getattr(client, route.method)(
+                path, data, format='json', **headers
+            )
+            if response.streaming:
+                b''.join(response.streaming_content)
+            timings.append((time.perf_counter() - started) * 1000)
+        if response.has_header('ETag'):
+            state.etags[path] = response['ETag']
+        queries = max(queries, len(context))
+        statuses.add(response.status_code)
+        if route.method != 'get':
+            # Операции записи возвращают состояние назад через парный
+            # маршрут, поэтому повторять их нельзя.
+            break
+    consistent = route.check(state) if route.check else True
+    return {
+        'route': route.name,
+        'method': route.method.upper(),
+        'page_size': page_size if route.paginated else None,
+        'status': sorted(statuses),
+        'queries': queries,
+        'budget': route.budget,
+        'timings_ms': {
+            'min': round(min(timings), 3),
+            'median': round(statistics.median(timings), 3),
+            'max': round(max(timings), 3),
+        },
+        'consistent': consistent,
+        'ok': (
+            queries <= route.budget and statuses == {route.status}
+            and consistent
+        ),
+    }
+
+
+def run_benchmark(client, viewer, page_sizes, repeat):
+    state = State(viewer)
+    results = []
+    for route in ROUTES:
+        sizes = page_sizes if route.paginated else (None,)
+        for page_size in sizes:
+            results.append(measure(client, route, state, page_size, repeat))
+    return results
@@ -0,0 +1,192 @@
+""" Кэши API.
+Множества id пользователя: для каждого пользователя хранятся id рецептов
+в избранном, id рецептов в списке покупок и id авторов, на которых он
+подписан. Флаги is_favorited, is_in_shopping_cart и is_subscribed
+вычисляются проверкой вхождения в эти множества. Любая запись
+избранного, списка покупок или подписки (в том числе из админки)
+удаляет запись пользователя из кэша. Кэш USER_FLAGS_CACHE должен быть
+общим для всех веб-процессов: в кэше другого процесса запись
+осталась бы прежней до истечения USER_FLAGS_CACHE_TIMEOUT.
+Версии данных: метка, которая меняется при каждом изменении набора
+данных; по ней процессы узнают, что построенные в памяти структуры
+устарели. Версии хранятся в отдельном кэше DATA_VERSIONS_CACHE,
+общем для веб-процессов и команд управления.
+Снимки: структуры в памяти процесса (индексы поиска, заранее
+отрендеренный JSON справочников со строгим ETag), которые строятся
+заново, когда меняется версия их наборов данных.
+ETag рецептов складывается из версий данных и версии множеств id
+зрителя, поэтому проверяется без сериализации ответа.
+"""
+import hashlib
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.renderers import JSONRenderer
+
+from recipes.models import Favourite, ShoppingList
+from users.models import Subscribe
+
+FAVOURITES = 'favourites'
+SHOPPING_CART = 'shopping_cart'
+SUBSCRIPTIONS = 'subscriptions'
+
+# Наборы данных с версиями.
+INGREDIENTS = 'ingredients'
+RECIPES = 'recipes'
+RECIPE_INGREDIENTS = 'recipe_ingredients'
+TAGS = 'tags'
+
+stats = {'hits': 0, 'misses': 0}
+
+
+def get_cache():
+    return caches[settings.USER_FLAGS_CACHE]
+
+
+def cache_key(user_id):
+    return f'user-flags:{user_id}'
+
+
+def load_user_flags(user_id):
+    return {
+        FAVOURITES: set(Favourite.objects.filter(
+            user_id=user_id
+        ).values_list('recipe_id', flat=True)),
+        SHOPPING_CART: set(ShoppingList.objects.filter(
+            user_id=user_id
+        ).values_list('recipe_id', flat=True)),
+        SUBSCRIPTIONS: set(Subscribe.objects.filter(
+            subscriber_id=user_id
+        ).values_list('subscribing_id', flat=True)),
+        'version': uuid.uuid4().hex,
+    }
+
+
+def get_user_flags(user):
+    """ Множества id пользователя; для анонима — None. """
+    if user.is_anonymous:
+        return None
+    cache = get_cache()
+    flags = cache.get(cache_key(user.id))
+    if flags is None:
+        stats['misses'] += 1
+        flags = load_user_flags(user.id)
+        cache.set(
+            cache_key(user.id), flags, settings.USER_FLAGS_CACHE_TIMEOUT
+        )
+    else:
+        stats['hits'] += 1
+    return flags
+
+
+def invalidate_user_flags(user_id):
+    """ Удаляет множества id пользователя из кэша: при следующем чтении
+    они загружаются из БД. Запись не правит множество в кэше на месте,
+    поэтому параллельные изменения не теряют id.
+    """
+    get_cache().delete(cache_key(user_id))
+
+
+def get_versions_cache():
+    return caches[settings.DATA_VERSIONS_CACHE]
+
+
+def get_version(name):
+    """ Текущая версия набора данных name. """
+    cache = get_versions_cache()
+    key = f'version:{name}'
+    if key not in cache:
+        cache.add(key, uuid.uuid4().hex, None)
+    return cache.get(key)
+
+
+def get_changed_at(name):
+    """ Время последнего изменения набора данных name (Unix-время).
+    Если оно неизвестно (кэш версий очищен), изменением считается
+    первое обращение: так Last-Modified не окажется раньше
+    настоящего изменения.
+    """
+    cache = get_versions_cache()
+    key = f'changed:{name}'
+    if key not in cache:
+        cache.add(key, time.time(), None)
+    return cache.get(key)
+
+
+def bump_version(name):
+    """ Отмечает, что набор данных name изменился. """
+    get_versions_cache().set_many({
+        f'version:{name}': uuid.uuid4().hex,
+        f'changed:{name}': time.time(),
+    }, None)
+
+
+def make_etag(*parts):
+    """ Строгий ETag из составляющих версии ответа. """
+    digest = hashlib.sha1(
+        '|'.join(str(part) for part in parts).encode()
+    ).hexdigest()
+    return f'"{digest}"'
+
+
+class VersionedSnapshot:
+    """ Структура в памяти процесса, построенная из наборов данных names.
+    Пока их версии не меняются, get() отдаёт тот же снимок. После
+    изменения снимок строится заново под блокировкой и заменяется
+    целиком, поэтому читатели без блокировки видят либо старый, либо
+    новый снимок и никогда — наполовину обновлённый. Если задано
+    interval — имя настройки с числом секунд, — новая версия
+    подхватывается не чаще раза в столько секунд.
+    """
+
+    def __init__(self, names, build, interval=None):
+        self.names = tuple(names)
+        self.build = build
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.version = None
+        self.state = None
+        self.built = 0.0
+
+    def fresh(self):
+        if self.state is None or self.interval is None:
+            return False
+        return (
+            time.monotonic() - self.built
+            < getattr(settings, self.interval)
+        )
+
+    def get(self):
+        version = tuple(get_version(name) for name in self.names)
+        if version != self.version and not self.fresh():
+            with self.lock:
+                if version != self.version:
+                    self.state = self.build()
+                    self.version = version
+                    self.built = time.monotonic()
+        return self.state
+
+
+class PrerenderedPayload(VersionedSnapshot):
+    """ JSON-ответ, отрендеренный один раз на версию набора данных:
+    снимок — пара (etag, тело ответа в байтах).
+    """
+
+    def __init__(self, name, build):
+        super().__init__((name, ), lambda: self.render(build()))
+
+    @staticmethod
+    def render(data):
+        body = JSONRenderer().render(data)
+        return f'"{hashlib.sha1(body).hexdigest()}"', body
+
+
+def get_stats():
+    requests = stats['hits'] + stats['misses']
+    return {
+        **stats,
+        'hit_ratio': round(stats['hits'] / requests, 4) if requests else None,
+    }
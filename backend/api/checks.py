@@ -0,0 +1,27 @@
+from django.conf import settings
+from django.core.checks import Error, register
+
+# Кэши, которые не видны другим процессам.
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+@register()
+def check_versions_cache(app_configs, **kwargs):
+    """ Версии данных меняют и команды управления: если кэш версий
+    виден только своему процессу, веб-процесс не узнает об импорте
+    ингредиентов или пересчёте популярности и будет отдавать
+    устаревшие ответы и индексы до перезапуска.
+    """
+    backend = settings.CACHES[settings.DATA_VERSIONS_CACHE]['BACKEND']
+    if backend in PROCESS_LOCAL_CACHES:
+        return [Error(
+            f'Кэш версий данных {settings.DATA_VERSIONS_CACHE!r} '
+            f'({backend}) не общий для процессов.',
+            hint='Укажите VERSIONS_CACHE_BACKEND: файловый кэш, '
+                 'memcached или redis.',
+            id='api.E001',
+        )]
+    return []
@@ -0,0 +1,125 @@
+""" Выгрузка списка покупок в форматах txt, csv и pdf.
+Текст и CSV отдаются потоком: строки читаются из БД курсором
+(в PostgreSQL — серверным) и сразу уходят клиенту.
+PDF рисуется в пуле процессов, чтобы не занимать поток запроса,
+и кэшируется по версии корзины — хэшу строк её готовых сумм:
+повторная выгрузка неизменной корзины читает только их, без reportlab.
+Версия меняется вместе с содержимым PDF, и только с ним: ни записи
+чужих рецептов, ни кэш флагов пользователя на неё не влияют. Если отрисовка
+не уложилась в SHOPPING_CART_PDF_TIMEOUT или процесс пула упал,
+выгрузка отвечает 503, а пул создаётся заново.
+"""
+import csv
+import threading
+from concurrent import futures
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+
+from api.cache import get_cache, make_etag
+from api.pdf import render_shopping_list
+from recipes.models import ShoppingCartIngredient
+
+TITLE = 'Список покупок'
+FORMATS = ('txt', 'csv', 'pdf')
+
+
+class RenderError(Exception):
+    """ PDF не удалось нарисовать: истекло время или упал пул. """
+
+
+class RenderPool:
+    """ Пул процессов для отрисовки PDF, создаётся при первой выгрузке. """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.executor = None
+
+    def get_executor(self):
+        with self.lock:
+            if self.executor is None:
+                self.executor = futures.ProcessPoolExecutor(
+                    max_workers=settings.SHOPPING_CART_PDF_WORKERS
+                )
+            return self.executor
+
+    def reset(self, executor):
+        """ Заменяет пул: ожидающие задачи отменяются, занятые процессы
+        завершаются после текущей задачи, новые выгрузки идут в новый пул.
+        """
+        with self.lock:
+            if self.executor is executor:
+                self.executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def render(self, rows):
+        executor = self.get_executor()
+        try:
+            future = executor.submit(
+                render_shopping_list, TITLE, rows,
+                settings.SHOPPING_CART_PDF_FONT
+            )
+            return future.result(timeout=settings.SHOPPING_CART_PDF_TIMEOUT)
+        except futures.TimeoutError:
+            # Задача из очереди просто отменяется; если она уже рисуется,
+            # пул заменяется, чтобы зависшая отрисовка не держала очередь.
+            if not future.cancel():
+                self.reset(executor)
+            raise RenderError(
+                'PDF не успел сформироваться, повторите запрос позже.'
+            )
+        except BrokenProcessPool:
+            self.reset(executor)
+            raise RenderError(
+                'Не удалось сформировать PDF, повторите запрос позже.'
+            )
+
+
+render_pool = RenderPool()
+
+
+def cart_rows(user):
+    """ Строки (название, единица измерения, сумма) из готовых сумм
+    списка покупок: одно чтение по индексу (user, ingredient).
+    """
+    return ShoppingCartIngredient.objects.filter(user=user).values_list(
+        'ingredient__name', 'ingredient__measurement_unit', 'amount'
+    ).order_by('ingredient__name', 'ingredient__measurement_unit').iterator(
+        chunk_size=settings.SHOPPING_CART_EXPORT_CHUNK_SIZE
+    )
+
+
+def stream_txt(user):
+    yield f'{TITLE} \n'
+    separator = ''
+    for name, measurement_unit, amount in cart_rows(user):
+        yield f'{separator}- {name} ({measurement_unit}) - {amount}'
+        separator = '\n'
+
+
+class Echo:
+    """ Буфер для csv.writer, который возвращает строку, а не пишет её. """
+
+    def write(self, value):
+        return value
+
+
+def stream_csv(user):
+    writer = csv.writer(Echo())
+    yield writer.writerow(('Ингредиент', 'Единица измерения', 'Количество'))
+    for row in cart_rows(user):
+        yield writer.writerow(row)
+
+
+def get_pdf(user):
+    """ Пара (версия корзины, PDF в байтах). """
+    rows = list(cart_rows(user))
+    version = make_etag(*rows)
+    cache = get_cache()
+    key = f'shopping-cart-pdf:{user.id}'
+    cached = cache.get(key)
+    if cached is not None and cached[0] == version:
+        return cached
+    pdf = render_pool.render(rows)
+    cache.set(key, (version, pdf), settings.USER_FLAGS_CACHE_TIMEOUT)
+    return version, pdf
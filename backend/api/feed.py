@@ -0,0 +1,64 @@
+""" Лента рецептов авторов, на которых подписан пользователь.
+Страница — рецепты с id меньше before по убыванию id (пагинация по
+ключу, без OFFSET). Обычному подписчику страница отдаётся одним
+запросом по индексу автора со списком id авторов из кэша флагов
+пользователя: с подзапросом подписок SQLite не знает числа авторов
+и обходит всю таблицу рецептов. Если подписок больше
+FEED_FANIN_THRESHOLD, список авторов в таком запросе становится
+слишком большим для планировщика: авторы делятся
+на группы по FEED_MERGE_CHUNK_SIZE, для каждой группы читаются
+не больше limit последних рецептов, и потоки сливаются heapq.merge.
+Число запросов ограничено числом групп, а каждый читает не больше
+limit строк.
+"""
+import heapq
+from itertools import islice
+
+from django.conf import settings
+
+from recipes.models import Recipe
+
+
+def recipe_ids(queryset, before, limit):
+    if before is not None:
+        queryset = queryset.filter(id__lt=before)
+    return list(queryset.order_by('-id').values_list(
+        'id', flat=True
+    )[:limit])
+
+
+def direct(author_ids, before, limit):
+    """ id страницы одним запросом по списку авторов. """
+    return recipe_ids(
+        Recipe.objects.filter(author_id__in=sorted(author_ids)),
+        before, limit
+    )
+
+
+def merged(author_ids, before, limit):
+    """ id страницы слиянием потоков по группам авторов. """
+    author_ids = sorted(author_ids)
+    size = settings.FEED_MERGE_CHUNK_SIZE
+    streams = [
+        recipe_ids(
+            Recipe.objects.filter(author_id__in=chunk), before, limit
+        )
+        for chunk in (
+            author_ids[start:start + size]
+            for start in range(0, len(author_ids), size)
+        )
+    ]
+    return list(islice(
+        heapq.merge(*streams, key=lambda recipe_id: -recipe_id), limit
+    ))
+
+
+def feed_ids(subscriptions, before=None, limit=10):
+    """ id рецептов страницы ленты. subscriptions — множество id
+    авторов из кэша флагов пользователя.
+    """
+    if not subscriptions:
+        return []
+    if len(subscriptions) > settings.FEED_FANIN_THRESHOLD:
+        return merged(subscriptions, before, limit)
+    return direct(subscriptions, before, limit)
@@ -0,0 +1,145 @@
+""" Поля сериализаторов. """
+import base64
+import binascii
+import uuid
+
+from django.conf import settings
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from PIL import Image
+from rest_framework import serializers
+
+# Сигнатуры допустимых форматов: (смещение, байты) -> расширение.
+SIGNATURES = (
+    (((0, b'\x89PNG\r\n\x1a\n'), ), 'png', 'image/png'),
+    (((0, b'\xff\xd8\xff'), ), 'jpg', 'image/jpeg'),
+    (((0, b'GIF87a'), ), 'gif', 'image/gif'),
+    (((0, b'GIF89a'), ), 'gif', 'image/gif'),
+    (((0, b'RIFF'), (8, b'WEBP')), 'webp', 'image/webp'),
+)
+HEADER_SIZE = 12
+
+
+def sniff(header):
+    """ Расширение и MIME-тип по первым байтам файла или None. """
+    for parts, extension, content_type in SIGNATURES:
+        if all(header[offset:offset + len(magic)] == magic
+               for offset, magic in parts):
+            return extension, content_type
+    return None
+
+
+def base64_chunks(data, start, size):
+    """ Куски строки base64 с позиции start без пробельных символов,
+    длиной кратной четырём: каждый декодируется отдельно.
+    """
+    rest = ''
+    for position in range(start, len(data), size):
+        piece = rest + ''.join(data[position:position + size].split())
+        cut = len(piece) // 4 * 4
+        rest = piece[cut:]
+        if cut:
+            yield piece[:cut]
+    if rest:
+        yield rest
+
+
+class StreamingBase64ImageField(serializers.ImageField):
+    """ Изображение в base64 (можно в виде data URI).
+    Строка декодируется кусками прямо во временный файл, поэтому
+    декодированные байты целиком в памяти не держатся. Пробелы и
+    переводы строк (base64 с переносами по 76 символов) отбрасываются,
+    остальное проверяется строго. Размер проверяется по ходу
+    декодирования, по первым байтам — формат, а по заголовку
+    изображения — ширина и высота, до распаковки пикселей.
+    """
+
+    default_error_messages = {
+        'invalid_base64': 'Изображение должно быть строкой base64.',
+        'invalid_format': (
+            'Допустимые форматы изображения: PNG, JPEG, GIF, WEBP.'
+        ),
+        'too_large': 'Размер изображения больше {max_size} байт.',
+        'too_many_pixels': (
+            'Изображение больше допустимых {max_width}x{max_height} '
+            'пикселей.'
+        ),
+    }
+
+    def to_internal_value(self, data):
+        if data in (None, ''):
+            if self.required:
+                self.fail('required')
+            return None
+        if not isinstance(data, str):
+            self.fail('invalid_base64')
+        start = data.find(';base64,')
+        start = 0 if start == -1 else start + len(';base64,')
+        upload = self.decode(data, start)
+        self.check_dimensions(upload)
+        return super().to_internal_value(upload)
+
+    def decode(self, data, start):
+        """ Декодирует base64 кусками во временный файл. Формат
+        определяется по первым HEADER_SIZE байтам, до записи остального;
+        декодирование прекращается, как только превышен размер.
+        """
+        header = b''
+        upload = None
+        try:
+            for piece in base64_chunks(
+                data, start, settings.RECIPE_IMAGE_DECODE_CHUNK
+            ):
+                decoded = base64.b64decode(piece, validate=True)
+                if upload is None:
+                    header += decoded
+                    if len(header) < HEADER_SIZE:
+                        continue
+                    upload = self.open_upload(header)
+                    decoded = header
+                self.write(upload, decoded)
+            if upload is None:
+                upload = self.open_upload(header)
+                self.write(upload, header)
+        except (binascii.Error, ValueError):
+            if upload is not None:
+                upload.close()
+            self.fail('invalid_base64')
+        except serializers.ValidationError:
+            if upload is not None:
+                upload.close()
+            raise
+        upload.size = upload.tell()
+        upload.seek(0)
+        return upload
+
+    def write(self, upload, decoded):
+        max_size = settings.RECIPE_IMAGE_MAX_SIZE
+        if upload.tell() + len(decoded) > max_size:
+            self.fail('too_large', max_size=max_size)
+        upload.write(decoded)
+
+    def open_upload(self, header):
+        detected = sniff(header)
+        if detected is None:
+            self.fail('invalid_format')
+        extension, content_type = detected
+        return TemporaryUploadedFile(
+            f'{uuid.uuid4()}.{extension}', content_type, 0, None
+        )
+
+    def check_dimensions(self, upload):
+        """ Ширина и высота из заголовка: Image.open не распаковывает
+        пиксели, поэтому «бомба» отсекается до полного декодирования.
+        """
+        max_width, max_height = settings.RECIPE_IMAGE_MAX_DIMENSIONS
+        try:
+            with Image.open(upload.temporary_file_path()) as image:
+                width, height = image.size
+        except Exception:
+            upload.close()
+            self.fail('invalid_image')
+        if width > max_width or height > max_height:
+            upload.close()
+            self.fail(
+                'too_many_pixels', max_width=max_width, max_height=max_height
+            )
@@ -1,6 +1,7 @@
 from django_filters.rest_framework import FilterSet, filters
 from rest_framework.filters import SearchFilter
 
+from api.recipe_index import IndexedRecipes, recipe_index
 from recipes.models import Ingredient, Recipe, Tag
 
 
@@ -13,9 +14,28 @@ class IngredientFilter(SearchFilter):
         fields = ['name']
 
 
+class NumberInFilter(filters.BaseInFilter, filters.NumberFilter):
+    """ Список чисел через запятую. """
+
+
+class TagSlugFilter(filters.ModelMultipleChoiceFilter):
+    """ Теги по слагу. Форма уже загрузила выбранные теги, поэтому
+    рецепты отбираются подзапросом к связующей таблице по id тегов:
+    без соединения с таблицей тегов и без DISTINCT, а SQLite читает
+    подзапрос по индексу тега, а не обходит все рецепты.
+    """
+
+    def filter(self, qs, value):
+        if not value:
+            return qs
+        return qs.filter(id__in=Recipe.tags.through.objects.filter(
+            tag__in=value
+        ).values('recipe_id'))
+
+
 class RecipeFilter(FilterSet):
-    tags = filters.ModelMultipleChoiceFilter(
-        field_name='tags__slug',
+    tags = TagSlugFilter(
+        field_name='tags',
         to_field_name='slug',
         queryset=Tag.objects.all(),
     )
@@ -26,10 +46,24 @@ class RecipeFilter(FilterSet):
     is_in_shopping_cart = filters.NumberFilter(
         method='get_is_in_shopping_cart'
     )
+    search = filters.CharFilter(method='get_search')
+    # Фильтры по ингредиентам отвечают по обратному индексу в памяти
+    # все вместе, в filter_queryset.
+    ingredients_all = NumberInFilter(method='get_ingredients')
+    ingredients_any = NumberInFilter(method='get_ingredients')
+    ingredients_none = NumberInFilter(method='get_ingredients')
+    ingredients_available = NumberInFilter(method='get_ingredients')
+    missing_max = filters.NumberFilter(
+        method='get_ingredients', min_value=0
+    )
 
     class Meta:
         model = Recipe
-        fields = ['tags', 'author', 'is_favorited', 'is_in_shopping_cart']
+        fields = [
+            'tags', 'author', 'is_favorited', 'is_in_shopping_cart', 'search',
+            'ingredients_all', 'ingredients_any', 'ingredients_none',
+            'ingredients_available', 'missing_max',
+        ]
 
     def get_is_favorited(self, queryset, name, value):
         if value:
@@ -40,3 +74,34 @@ class RecipeFilter(FilterSet):
         if value:
             return queryset.filter(shopping_list__user=self.request.user)
         return queryset
+
+    def get_search(self, queryset, name, value):
+        """ Полнотекстовый поиск: самые релевантные рецепты первыми. """
+        value = value.strip()
+        if not value:
+            return queryset
+        return queryset.search(value).order_by('-search_rank', '-id')
+
+    def get_ingredients(self, queryset, name, value):
+        return queryset
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        data = self.form.cleaned_data
+        conditions = {
+            'all_of': data.get('ingredients_all'),
+            'any_of': data.get('ingredients_any'),
+            'none_of': data.get('ingredients_none'),
+            'available': data.get('ingredients_available'),
+        }
+        if not any(conditions.values()):
+            return queryset
+        conditions = {
+            key: [int(value) for value in values]
+            for key, values in conditions.items() if values
+        }
+        missing_max = data.get('missing_max')
+        return IndexedRecipes(queryset, recipe_index.match(
+            **conditions,
+            missing_max=int(missing_max) if missing_max is not None else 0
+        ))
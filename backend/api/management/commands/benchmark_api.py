@@ -0,0 +1,106 @@
+import json
+import tempfile
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+from rest_framework.test import APIClient
+
+from api.benchmark import run_benchmark, seed_dataset
+from api.thumbnails import thumbnail_pool
+
+# Отдельный кэш, чтобы прогон не смешивался с кэшем рабочих данных.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'benchmark',
+    },
+    # Прогон идёт в одном процессе, поэтому версии можно держать
+    # в его памяти.
+    'versions': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'benchmark-versions',
+    },
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Прогоняет все маршруты API на сгенерированных данных, '
+        'проверяет бюджет запросов к БД и сохраняет замеры времени в JSON.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--page-sizes', type=int, nargs='+', default=[6, 20, 50],
+            help='Размеры страниц для маршрутов с пагинацией.'
+        )
+        parser.add_argument(
+            '--repeat', type=int, default=5,
+            help='Сколько раз выполнять каждый маршрут чтения.'
+        )
+        parser.add_argument(
+            '--users', type=int, default=30,
+            help='Количество пользователей в наборе данных.'
+        )
+        parser.add_argument(
+            '--recipes-per-user', type=int, default=20,
+            help='Количество рецептов у каждого пользователя.'
+        )
+        parser.add_argument(
+            '--output', default='benchmark_report.json',
+            help='Файл отчёта.'
+        )
+
+    def handle(self, *args, **options):
+        # Прогон идёт в отдельной тестовой базе (для SQLite — в памяти)
+        # и с отдельным кэшем, рабочие данные не затрагиваются.
+        # Миниатюры откладываются и готовятся после замеров: в работе
+        # их делает фоновый пул, а не запрос.
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            with tempfile.TemporaryDirectory() as media_root, \
+                    override_settings(MEDIA_ROOT=media_root, CACHES=CACHES,
+                                      RECIPE_THUMBNAILS_ASYNC=False):
+                viewer = seed_dataset(
+                    users=options['users'],
+                    recipes_per_user=options['recipes_per_user'],
+                )
+                client = APIClient(SERVER_NAME='localhost')
+                client.force_authenticate(viewer)
+                results = run_benchmark(
+                    client, viewer, options['page_sizes'], options['repeat']
+                )
+                thumbnail_pool.wait()
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        report = {
+            'database': connection.vendor,
+            'dataset': {
+                'users': options['users'],
+                'recipes_per_user': options['recipes_per_user'],
+            },
+            'results': results,
+        }
+        with open(options['output'], 'w', encoding='utf-8') as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+
+        for row in results:
+            page = f' limit={row["page_size"]}' if row['page_size'] else ''
+            self.stdout.write(
+                f'{"OK  " if row["ok"] else "FAIL"} {row["route"]}{page}: '
+                f'{row["queries"]}/{row["budget"]} запросов, '
+                f'{row["timings_ms"]["median"]} мс, статус {row["status"]}'
+                f'{"" if row["consistent"] else ", данные расходятся"}'
+            )
+        failed = [row['route'] for row in results if not row['ok']]
+        if failed:
+            raise CommandError(
+                f'Превышен бюджет запросов, неверный статус или '
+                f'расхождение данных: '
+                f'{", ".join(sorted(set(failed)))}. '
+                f'Отчёт: {options["output"]}'
+            )
+        self.stdout.write(f'Отчёт сохранён в {options["output"]}')
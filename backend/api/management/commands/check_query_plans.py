@@ -0,0 +1,103 @@
+import json
+import tempfile
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+
+from api.benchmark import seed_dataset
+from api.management.commands.benchmark_api import CACHES
+from api.query_plans import UnexpectedResponseError, audit
+
+
+class Command(BaseCommand):
+    help = (
+        'Снимает EXPLAIN горячих запросов на сгенерированных данных и '
+        'завершается ошибкой, если план полностью просматривает таблицу '
+        'больше --min-rows строк.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--users', type=int, default=100,
+            help='Количество пользователей в наборе данных.'
+        )
+        parser.add_argument(
+            '--recipes-per-user', type=int, default=30,
+            help='Количество рецептов у каждого пользователя.'
+        )
+        parser.add_argument(
+            '--favourites-per-user', type=int, default=20,
+            help='Сколько рецептов каждый пользователь добавляет '
+                 'в избранное.'
+        )
+        parser.add_argument(
+            '--page-size', type=int, default=6,
+            help='Размер страницы в запросах со страницами.'
+        )
+        parser.add_argument(
+            '--min-rows', type=int, default=1000,
+            help='Полный просмотр таблиц меньше этого размера допустим.'
+        )
+        parser.add_argument(
+            '--output',
+            help='Файл отчёта с планами в JSON.'
+        )
+
+    def handle(self, *args, **options):
+        # Как benchmark_api: отдельная тестовая база и отдельный кэш.
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            with tempfile.TemporaryDirectory() as media_root, \
+                    override_settings(MEDIA_ROOT=media_root, CACHES=CACHES,
+                                      RECIPE_THUMBNAILS_ASYNC=False):
+                viewer = seed_dataset(
+                    users=options['users'],
+                    recipes_per_user=options['recipes_per_user'],
+                    favourites_per_user=options['favourites_per_user'],
+                )
+                try:
+                    results = audit(
+                        viewer, options['page_size'], options['min_rows']
+                    )
+                except (NotImplementedError, UnexpectedResponseError) as error:
+                    raise CommandError(error)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                json.dump({
+                    'database': connection.vendor,
+                    'min_rows': options['min_rows'],
+                    'results': results,
+                }, file, ensure_ascii=False, indent=2)
+
+        for row in results:
+            self.stdout.write(
+                f'{"OK  " if row["ok"] else "FAIL"} {row["query"]}: '
+                f'{row["description"]}'
+            )
+            if options['verbosity'] > 1 or row['violations']:
+                for line in row['plan']:
+                    self.stdout.write(f'    {line}')
+            for violation in row['violations']:
+                self.stdout.write(f'    полный просмотр: {violation}')
+        missed = [
+            row['query'] for row in results
+            if row['control'] and not row['ok']
+        ]
+        if missed:
+            raise CommandError(
+                f'Проверка не нашла полный просмотр в контрольных '
+                f'запросах: {", ".join(missed)}.'
+            )
+        failed = [row['query'] for row in results if not row['ok']]
+        if failed:
+            raise CommandError(
+                f'Полный просмотр больших таблиц: {", ".join(failed)}.'
+            )
+        self.stdout.write(
+            'Полных просмотров больших таблиц в горячих запросах нет.'
+        )
@@ -0,0 +1,129 @@
+import os
+import shutil
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from sorl.thumbnail import delete
+from sorl.thumbnail.images import ImageFile
+
+from recipes.models import Recipe
+
+
+def referenced(directory, chunk_size):
+    """ Имена файлов каталога directory (путь относительно MEDIA_ROOT),
+    на которые ссылаются рецепты. Ссылки читаются итератором, в памяти
+    остаются только ссылки на файлы этого каталога.
+    """
+    prefix = f'{directory}/'
+    names = Recipe.objects.filter(
+        image__startswith=prefix
+    ).values_list('image', flat=True).iterator(chunk_size=chunk_size)
+    return {
+        name[len(prefix):] for name in names
+        if '/' not in name[len(prefix):]
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        'Удаляет из каталога изображений рецептов файлы, на которые '
+        'не ссылается ни один рецепт и которые старше льготного периода. '
+        'С --quarantine переносит их в отдельный каталог.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--grace', type=int, default=settings.MEDIA_ORPHAN_GRACE_PERIOD,
+            help='Не трогать файлы моложе стольких секунд.'
+        )
+        parser.add_argument(
+            '--quarantine', metavar='DIR',
+            help='Переносить файлы в этот каталог вместо удаления.'
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только посчитать файлы, ничего не удаляя.'
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=2000,
+            help='Сколько ссылок читать из БД за раз.'
+        )
+
+    def handle(self, *args, **options):
+        if options['grace'] < 0:
+            raise CommandError('--grace не может быть отрицательным.')
+        self.storage = Recipe._meta.get_field('image').storage
+        self.options = options
+        self.quarantine = (
+            os.path.abspath(options['quarantine'])
+            if options['quarantine'] else None
+        )
+        self.deadline = time.time() - options['grace']
+        self.stats = {
+            'scanned': 0, 'referenced': 0, 'fresh': 0,
+            'orphaned': 0, 'bytes': 0, 'errors': 0,
+        }
+        root = Recipe._meta.get_field('image').upload_to.rstrip('/')
+        # Обход в глубину со стеком: в памяти только список каталогов
+        # и ссылки на файлы текущего каталога.
+        directories = [root]
+        while directories:
+            directories.extend(self.collect(directories.pop()))
+        action = (
+            'найдено' if options['dry_run']
+            else 'перенесено' if self.quarantine else 'удалено'
+        )
+        stats = self.stats
+        self.stdout.write(
+            f'Просмотрено файлов - {stats["scanned"]}, используются - '
+            f'{stats["referenced"]}, моложе льготного периода - '
+            f'{stats["fresh"]}. Лишних файлов {action} - '
+            f'{stats["orphaned"]} ({stats["bytes"]} байт).'
+            f' Ошибок - {stats["errors"]}.'
+        )
+
+    def collect(self, directory):
+        """ Обрабатывает файлы каталога, возвращает подкаталоги. """
+        path = self.storage.path(directory)
+        if not os.path.isdir(path):
+            return []
+        used = referenced(directory, self.options['chunk_size'])
+        subdirectories = []
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if os.path.abspath(entry.path) != self.quarantine:
+                        subdirectories.append(f'{directory}/{entry.name}')
+                    continue
+                if not entry.is_file(follow_symlinks=False):
+                    continue
+                self.stats['scanned'] += 1
+                if entry.name in used:
+                    self.stats['referenced'] += 1
+                    continue
+                stat = entry.stat(follow_symlinks=False)
+                if stat.st_mtime > self.deadline:
+                    self.stats['fresh'] += 1
+                    continue
+                self.remove(f'{directory}/{entry.name}', stat.st_size)
+        return subdirectories
+
+    def remove(self, name, size):
+        if not self.options['dry_run']:
+            image_file = ImageFile(name, self.storage)
+            try:
+                if self.quarantine:
+                    # Миниатюры можно построить заново, оригинал — нет.
+                    delete(image_file, delete_file=False)
+                    target = os.path.join(self.quarantine, name)
+                    os.makedirs(os.path.dirname(target), exist_ok=True)
+                    shutil.move(self.storage.path(name), target)
+                else:
+                    delete(image_file)
+            except Exception as error:
+                self.stats['errors'] += 1
+                self.stderr.write(f'{name}: {error}')
+                return
+        self.stats['orphaned'] += 1
+        self.stats['bytes'] += size
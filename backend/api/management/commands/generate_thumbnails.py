@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from api.thumbnails import generate
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = (
+        'Готовит миниатюры изображений рецептов, для которых их ещё нет. '
+        'С --all пересоздаёт миниатюры всех рецептов.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all', action='store_true',
+            help='Пересоздать миниатюры у всех рецептов с изображением.'
+        )
+
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.exclude(image='').exclude(image__isnull=True)
+        if not options['all']:
+            recipes = recipes.filter(thumbnails={})
+        done = 0
+        for recipe_id, image_name in recipes.values_list(
+            'id', 'image'
+        ).iterator():
+            generate(recipe_id, image_name)
+            done += 1
+        self.stdout.write(f'Обработано рецептов - {done}.')
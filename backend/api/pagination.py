@@ -1,5 +1,61 @@
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+
+
+class CustomCursorPagination(CursorPagination):
+    """ Пагинация по курсору: ключ — id записи, без COUNT(*) и OFFSET.
+    Страницы не съезжают, когда появляются новые записи.
+    """
+    page_size_query_param = 'limit'
+    ordering = '-id'
 
 
 class CustomPagination(PageNumberPagination):
+    """ Пагинация по номеру страницы.
+    Действия, перечисленные во вьюсете в cursor_pagination_actions,
+    переходят на пагинацию по курсору с параметром ?pagination=cursor
+    (или при наличии параметра cursor из ссылок next/previous).
+    Порядок курсора задаётся во вьюсете в cursor_ordering и должен
+    совпадать с порядком страниц. Параметры из
+    cursor_pagination_conflicts задают свой порядок (например,
+    релевантность поиска), поэтому с курсором не сочетаются.
+    """
     page_size_query_param = 'limit'
+    mode_query_param = 'pagination'
+    cursor_pagination_class = CustomCursorPagination
+    cursor_paginator = None
+
+    def use_cursor(self, request, view):
+        allowed = getattr(view, 'cursor_pagination_actions', ())
+        if getattr(view, 'action', None) not in allowed:
+            return False
+        cursor = (
+            request.query_params.get(self.mode_query_param) == 'cursor'
+            or self.cursor_pagination_class.cursor_query_param
+            in request.query_params
+        )
+        if cursor:
+            for param in getattr(view, 'cursor_pagination_conflicts', ()):
+                if request.query_params.get(param, '').strip():
+                    raise ValidationError({
+                        self.mode_query_param: f'Пагинация по курсору не '
+                                               f'сочетается с параметром '
+                                               f'{param}.'
+                    })
+        return cursor
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.use_cursor(request, view):
+            self.cursor_paginator = self.cursor_pagination_class()
+            self.cursor_paginator.ordering = getattr(
+                view, 'cursor_ordering', self.cursor_paginator.ordering
+            )
+            return self.cursor_paginator.paginate_queryset(
+                queryset, request, view
+            )
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.cursor_paginator is not None:
+            return self.cursor_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
@@ -0,0 +1,45 @@
+""" Парсеры тела запроса. """
+import io
+
+from django.conf import settings
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from rest_framework.parsers import JSONParser
+
+
+class RequestTooLargeError(APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = 'Тело запроса слишком велико.'
+    default_code = 'request_too_large'
+
+
+class LimitedJSONParser(JSONParser):
+    """ JSON с пределом длины тела.
+    JSONParser читает поток запроса напрямую, и предел Django
+    DATA_UPLOAD_MAX_MEMORY_SIZE к нему не применяется. Этот парсер
+    отклоняет тело длиннее предела до разбора JSON: по Content-Length,
+    а без него — прочитав не больше предела. Вьюсет может задать свой
+    предел методом get_body_max_size().
+    """
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        get_limit = getattr(parser_context.get('view'), 'get_body_max_size',
+                            None)
+        limit = (
+            get_limit() if get_limit is not None
+            else settings.DATA_UPLOAD_MAX_MEMORY_SIZE
+        )
+        if limit is not None and stream is not None:
+            request = parser_context.get('request')
+            try:
+                length = int(request.META.get('CONTENT_LENGTH') or 0)
+            except (AttributeError, ValueError):
+                length = 0
+            body = b'' if length > limit else stream.read(limit + 1)
+            if len(body) > limit or length > limit:
+                raise RequestTooLargeError(
+                    f'Тело запроса больше {limit} байт.'
+                )
+            stream = io.BytesIO(body)
+        return super().parse(stream, media_type, parser_context)
@@ -0,0 +1,53 @@
+""" Отрисовка списка покупок в PDF.
+Модуль не зависит от Django: функция render_shopping_list выполняется
+в отдельном процессе пула и получает только готовые строки.
+"""
+import io
+import os
+
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.units import mm
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
+
+FONT_NAME = 'ShoppingListFont'
+FALLBACK_FONT = 'Helvetica'
+FONT_SIZE = 12
+TITLE_SIZE = 16
+MARGIN = 20 * mm
+LINE_HEIGHT = 7 * mm
+
+
+def register_font(font_path):
+    """ Шрифт с кириллицей; без него — встроенный Helvetica. """
+    if FONT_NAME in pdfmetrics.getRegisteredFontNames():
+        return FONT_NAME
+    if not font_path or not os.path.exists(font_path):
+        return FALLBACK_FONT
+    pdfmetrics.registerFont(TTFont(FONT_NAME, font_path))
+    return FONT_NAME
+
+
+def render_shopping_list(title, rows, font_path):
+    """ PDF со строками (название, единица измерения, количество). """
+    font = register_font(font_path)
+    buffer = io.BytesIO()
+    pdf = canvas.Canvas(buffer, pagesize=A4)
+    pdf.setTitle(title)
+    width, height = A4
+    pdf.setFont(font, TITLE_SIZE)
+    pdf.drawString(MARGIN, height - MARGIN, title)
+    y = height - MARGIN - 2 * LINE_HEIGHT
+    pdf.setFont(font, FONT_SIZE)
+    for name, measurement_unit, amount in rows:
+        if y < MARGIN:
+            pdf.showPage()
+            pdf.setFont(font, FONT_SIZE)
+            y = height - MARGIN
+        pdf.drawString(MARGIN, y, f'• {name} ({measurement_unit})')
+        pdf.drawRightString(width - MARGIN, y, str(amount))
+        y -= LINE_HEIGHT
+    pdf.showPage()
+    pdf.save()
+    return buffer.getvalue()
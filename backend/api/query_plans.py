@@ -0,0 +1,246 @@
+""" Планы выполнения горячих запросов API.
+Каждый горячий путь выполняется настоящим кодом — запросом к API через
+тестовый клиент или загрузчиком, который вызывает API, — а для всех
+выполненных им SELECT снимается EXPLAIN. Поэтому проверяются именно те
+запросы, которые строят вьюсеты, фильтры и загрузчики, а не их копии.
+В планах находятся полные просмотры таблиц: в PostgreSQL — узлы
+Seq Scan, в SQLite — строки SCAN плана EXPLAIN QUERY PLAN (псевдонимы
+подзапросов Django, например U0, сопоставляются с таблицами по тексту
+SQL). Просмотр считается нарушением, если в таблице больше min_rows
+строк: на маленьких таблицах планировщик законно предпочитает полный
+просмотр индексу. Единственное исключение в SQLite — страница таблицы
+без условий: SCAN по rowid по порядку до LIMIT строк без сортировки,
+то же, что Index Scan по pkey в PostgreSQL.
+Запросы CONTROL_QUERIES заведомо просматривают большие таблицы:
+если проверка не находит в них нарушений, сломана она сама.
+"""
+import json
+import re
+from dataclasses import dataclass
+from typing import Callable
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from api.cache import load_user_flags
+from recipes.models import AmountOfIngredient, Recipe
+
+# SCAN recipes_recipe, SEARCH U0 USING INDEX ..., SCAN recipes_recipe AS U0
+# (старые версии SQLite) — таблица или псевдоним и псевдоним.
+SQLITE_LOOP = re.compile(r'^(SCAN|SEARCH) (?:TABLE )?(\w+)(?: AS (\w+))?')
+# Псевдонимы в SQL Django: FROM "recipes_recipe" U0, JOIN "..." T3.
+SQL_ALIAS = re.compile(r'(?:FROM|JOIN) "(\w+)" (?:AS )?([A-Z]\d+)\b')
+SQL_LIMIT = re.compile(r'\bLIMIT \d+')
+
+
+class UnexpectedResponseError(Exception):
+    """ Горячий путь ответил не тем статусом: его запросы не те. """
+
+
+@dataclass
+class HotQuery:
+    name: str
+    run: Callable
+    description: str = ''
+    # Контрольный запрос: план обязан содержать нарушение.
+    control: bool = False
+
+
+class State:
+    """ Объекты набора данных и клиент API от имени зрителя. """
+
+    def __init__(self, viewer, page_size):
+        self.viewer = viewer
+        self.page_size = page_size
+        self.recipe = Recipe.objects.filter(
+            favourites__user=viewer, shopping_list__user=viewer
+        ).first()
+        self.tag = self.recipe.tags.first()
+        self.client = APIClient(SERVER_NAME='localhost')
+        self.client.force_authenticate(viewer)
+
+    def request(self, method, path, status=200):
+        separator = '&' if '?' in path else '?'
+        response = getattr(self.client, method)(
+            f'{path}{separator}limit={self.page_size}'
+        )
+        if response.status_code != status:
+            raise UnexpectedResponseError(
+                f'{method.upper()} {path}: статус {response.status_code}, '
+                f'ожидался {status}.'
+            )
+
+
+HOT_QUERIES = (
+    HotQuery(
+        'favourite-exists',
+        # Рецепт уже в избранном: вьюсет проверяет это и отвечает 400.
+        lambda s: s.request(
+            'post', f'/api/recipes/{s.recipe.id}/favorite/', 400
+        ),
+        'FavouriteApiView: рецепт уже в избранном',
+    ),
+    HotQuery(
+        'shopping-list-exists',
+        lambda s: s.request(
+            'post', f'/api/recipes/{s.recipe.id}/shopping_cart/', 400
+        ),
+        'ShoppingApiView: рецепт уже в списке покупок',
+    ),
+    HotQuery(
+        'user-flags',
+        lambda s: load_user_flags(s.viewer.id),
+        'load_user_flags: избранное, список покупок и подписки',
+    ),
+    HotQuery(
+        'recipes-is-favorited',
+        lambda s: s.request('get', '/api/recipes/?is_favorited=1'),
+        'RecipeFilter: is_favorited=1, страница с тегами и ингредиентами',
+    ),
+    HotQuery(
+        'recipes-is-in-shopping-cart',
+        lambda s: s.request('get', '/api/recipes/?is_in_shopping_cart=1'),
+        'RecipeFilter: is_in_shopping_cart=1',
+    ),
+    HotQuery(
+        'recipes-by-tag',
+        lambda s: s.request('get', f'/api/recipes/?tags={s.tag.slug}'),
+        'RecipeFilter: tags=<slug>',
+    ),
+    HotQuery(
+        'recipes-feed',
+        lambda s: s.request('get', '/api/recipes/feed/'),
+        'Лента подписок',
+    ),
+)
+
+CONTROL_QUERIES = (
+    HotQuery(
+        'control-unindexed-filter',
+        lambda s: list(Recipe.objects.filter(
+            text__contains='x'
+        ).values('id')[:s.page_size]),
+        'Условие без индекса при LIMIT',
+        control=True,
+    ),
+    HotQuery(
+        'control-subquery-scan',
+        lambda s: list(Recipe.objects.filter(
+            id__in=AmountOfIngredient.objects.filter(
+                amount__gt=0
+            ).values('recipe_id')
+        ).values('id')[:s.page_size]),
+        'Полный просмотр под псевдонимом подзапроса',
+        control=True,
+    ),
+)
+
+
+def captured_selects(query, state):
+    """ SELECT, выполненные горячим путём. """
+    with CaptureQueriesContext(connection) as context:
+        query.run(state)
+    return [
+        item['sql'] for item in context.captured_queries
+        if item['sql'].lstrip().upper().startswith('SELECT')
+    ]
+
+
+def explain(sql):
+    """ Строки плана и полные просмотры [(таблица, строка плана)]. """
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}')
+            plan = cursor.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            return postgresql_scans(plan[0]['Plan'])
+        if connection.vendor == 'sqlite':
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            # Страница таблицы без условий — обход rowid до LIMIT.
+            page = ' WHERE ' not in sql and bool(SQL_LIMIT.search(sql))
+            return sqlite_scans(
+                [row[3] for row in cursor.fetchall()], sql, page
+            )
+    raise NotImplementedError(
+        f'Планы запросов для {connection.vendor} не поддерживаются.'
+    )
+
+
+def postgresql_scans(root):
+    lines, scans = [], []
+    stack = [(root, 0)]
+    while stack:
+        node, depth = stack.pop()
+        relation = node.get('Relation Name')
+        line = '  ' * depth + node['Node Type']
+        if relation:
+            line += f' on {relation}'
+        lines.append(line)
+        if node['Node Type'] == 'Seq Scan':
+            scans.append((relation, line.strip()))
+        stack.extend(
+            (child, depth + 1) for child in reversed(node.get('Plans', ()))
+        )
+    return lines, scans
+
+
+def sqlite_scans(details, sql, page):
+    scans = []
+    tables = set(connection.introspection.table_names())
+    aliases = {alias: table for table, alias in SQL_ALIAS.findall(sql)}
+    loops = [
+        match for match in map(SQLITE_LOOP.match, details) if match
+    ]
+    walk = (
+        page and len(loops) == 1
+        and 'USE TEMP B-TREE FOR ORDER BY' not in details
+    )
+    for match in loops:
+        kind, name = match.group(1), match.group(2)
+        table = name if name in tables else aliases.get(name)
+        if kind != 'SCAN' or table is None:
+            continue
+        if walk and match.string == f'SCAN {name}':
+            continue
+        scans.append((table, match.string))
+    return details, scans
+
+
+def table_rows(table):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT COUNT(*) FROM {connection.ops.quote_name(table)}'
+        )
+        return cursor.fetchone()[0]
+
+
+def audit(viewer, page_size, min_rows):
+    """ Планы всех горячих запросов и найденные в них нарушения. """
+    with connection.cursor() as cursor:
+        # Свежая статистика, иначе планировщик выбирает по умолчаниям.
+        cursor.execute('ANALYZE')
+    state = State(viewer, page_size)
+    rows = {}
+    results = []
+    for query in HOT_QUERIES + CONTROL_QUERIES:
+        plan, violations = [], []
+        for sql in captured_selects(query, state):
+            lines, scans = explain(sql)
+            plan.append(f'SQL: {sql[:120]}')
+            plan.extend(f'  {line}' for line in lines)
+            for table, line in scans:
+                if table not in rows:
+                    rows[table] = table_rows(table)
+                if rows[table] > min_rows:
+                    violations.append(f'{line} ({rows[table]} строк)')
+        results.append({
+            'query': query.name,
+            'description': query.description,
+            'plan': plan,
+            'violations': violations,
+            'control': query.control,
+            'ok': bool(violations) == query.control,
+        })
+    return results
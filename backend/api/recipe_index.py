@@ -0,0 +1,206 @@
+""" Обратный индекс «ингредиент -> рецепты» в памяти процесса.
+Для каждого ингредиента хранятся отсортированный массив позиций
+рецептов и битовая карта (целое число Python: бит p — рецепт ids[p]).
+Пересечения, объединения и дополнения множеств рецептов считаются
+побитовыми операциями, без цепочки JOIN в SQL. Число найденных
+рецептов и срез страницы считаются по списку id в памяти (см.
+IndexedRecipes), в БД уходят только id страницы. Индекс строится при
+первом запросе и перестраивается, когда меняется версия
+RECIPE_INGREDIENTS (при каждой записи рецептов и их ингредиентов), но
+не чаще раза в RECIPE_INDEX_REFRESH_INTERVAL секунд: до перестройки
+новые рецепты в фильтры по ингредиентам не попадают.
+"""
+import bisect
+from array import array
+from collections import defaultdict
+
+from api.cache import RECIPE_INGREDIENTS, VersionedSnapshot
+from recipes.models import AmountOfIngredient, Recipe
+
+
+def to_bitmap(positions, size):
+    """ Битовая карта из позиций: одно преобразование байтов вместо
+    сдвига большого числа на каждую позицию.
+    """
+    buffer = bytearray((size + 7) // 8)
+    for position in positions:
+        buffer[position >> 3] |= 1 << (position & 7)
+    return int.from_bytes(buffer, 'little')
+
+
+def positions(bitmap):
+    """ Номера установленных битов по возрастанию. """
+    bits = format(bitmap, 'b')[::-1]
+    result = []
+    position = bits.find('1')
+    while position != -1:
+        result.append(position)
+        position = bits.find('1', position + 1)
+    return result
+
+
+class RecipePostings:
+    """ Позиции и битовые карты рецептов по ингредиентам. """
+
+    def __init__(self, recipe_ids, pairs):
+        self.ids = array('q', recipe_ids)
+        index = {recipe_id: number for number, recipe_id in
+                 enumerate(self.ids)}
+        lists = defaultdict(list)
+        self.counts = array('I', [0]) * len(self.ids)
+        for ingredient_id, recipe_id in pairs:
+            number = index.get(recipe_id)
+            if number is None:
+                continue
+            lists[ingredient_id].append(number)
+            self.counts[number] += 1
+        self.postings = {
+            ingredient_id: array('I', sorted(numbers))
+            for ingredient_id, numbers in lists.items()
+        }
+        self.bitmaps = {
+            ingredient_id: to_bitmap(numbers, len(self.ids))
+            for ingredient_id, numbers in self.postings.items()
+        }
+        self.universe = (1 << len(self.ids)) - 1
+        # Позиции рецептов по возрастанию числа ингредиентов.
+        self.by_count = sorted(
+            range(len(self.ids)), key=self.counts.__getitem__
+        )
+        self.sorted_counts = [self.counts[number] for number in self.by_count]
+
+
+def load_postings():
+    return RecipePostings(
+        Recipe.objects.order_by('id').values_list(
+            'id', flat=True
+        ).iterator(),
+        AmountOfIngredient.objects.order_by('recipe_id').values_list(
+            'ingredient_id', 'recipe_id'
+        ).iterator(),
+    )
+
+
+class RecipeIngredientIndex:
+
+    def __init__(self):
+        self.snapshot = VersionedSnapshot(
+            (RECIPE_INGREDIENTS, ), load_postings,
+            interval='RECIPE_INDEX_REFRESH_INTERVAL'
+        )
+
+    def match(self, all_of=None, any_of=None, none_of=None,
+              available=None, missing_max=0):
+        """ id рецептов по возрастанию, которые
+        содержат все ингредиенты all_of, хотя бы один из any_of,
+        ни одного из none_of и которым из available не хватает
+        не больше missing_max ингредиентов.
+        Незаданные условия не ограничивают результат.
+        """
+        state = self.snapshot.get()
+        bitmap = state.universe
+        for ingredient_id in all_of or ():
+            bitmap &= state.bitmaps.get(ingredient_id, 0)
+        if any_of:
+            bitmap &= self.union(state, any_of)
+        if none_of:
+            bitmap &= ~self.union(state, none_of)
+        if available is not None and bitmap:
+            bitmap &= self.cookable(state, available, missing_max)
+        return [state.ids[number] for number in positions(bitmap)]
+
+    @staticmethod
+    def union(state, ingredient_ids):
+        bitmap = 0
+        for ingredient_id in ingredient_ids:
+            bitmap |= state.bitmaps.get(ingredient_id, 0)
+        return bitmap
+
+    @staticmethod
+    def cookable(state, available, missing_max):
+        """ Рецепты, которым не хватает не больше missing_max
+        ингредиентов: число совпадений считается по массивам позиций
+        только имеющихся ингредиентов.
+        """
+        matched = defaultdict(int)
+        for ingredient_id in set(available):
+            for number in state.postings.get(ingredient_id, ()):
+                matched[number] += 1
+        result = [
+            number for number, count in matched.items()
+            if state.counts[number] - count <= missing_max
+        ]
+        # Рецепты без единого совпадения, в которых ингредиентов
+        # не больше missing_max.
+        end = bisect.bisect_right(state.sorted_counts, missing_max)
+        result.extend(
+            number for number in state.by_count[:end]
+            if number not in matched
+        )
+        return to_bitmap(result, len(state.ids))
+
+
+class IndexedRecipes:
+    """ Рецепты queryset, id которых входят в ids — результат индекса
+    по возрастанию. Ведёт себя для вьюсета и пагинации как queryset:
+    filter и order_by применяются к queryset, длина и срезы считаются
+    по списку id в памяти, а из БД читаются только рецепты среза.
+    Если queryset ничем не сужен и упорядочен по -id, порядок берётся
+    прямо из ids; иначе id queryset читаются одним запросом в его
+    порядке и пересекаются с ids. Список id в SQL не передаётся.
+    """
+    ordered = True
+
+    def __init__(self, queryset, ids):
+        self.queryset = queryset
+        self.ids = ids
+        self.allowed = frozenset(ids)
+        self.model = queryset.model
+        self._ordered_ids = None
+
+    def filter(self, *args, **kwargs):
+        return IndexedRecipes(self.queryset.filter(*args, **kwargs), self.ids)
+
+    def order_by(self, *fields):
+        return IndexedRecipes(self.queryset.order_by(*fields), self.ids)
+
+    def get(self, *args, **kwargs):
+        recipe = self.queryset.get(*args, **kwargs)
+        if recipe.pk not in self.allowed:
+            raise self.model.DoesNotExist
+        return recipe
+
+    def ordered_ids(self):
+        if self._ordered_ids is None:
+            query = self.queryset.query
+            ordering = tuple(query.order_by or self.model._meta.ordering)
+            if not query.where and ordering == ('-id', ):
+                self._ordered_ids = self.ids[::-1]
+            else:
+                self._ordered_ids = [
+                    pk for pk in self.queryset.prefetch_related(
+                        None
+                    ).values_list('id', flat=True)
+                    if pk in self.allowed
+                ]
+        return self._ordered_ids
+
+    def count(self):
+        return len(self.ordered_ids())
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        page = self.ordered_ids()[index]
+        recipes = self.queryset.in_bulk(page)
+        # Рецепт мог быть удалён после перестройки индекса.
+        return [recipes[pk] for pk in page if pk in recipes]
+
+    def __iter__(self):
+        return iter(self[:])
+
+
+recipe_index = RecipeIngredientIndex()
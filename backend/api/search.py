@@ -0,0 +1,120 @@
+""" Поиск ингредиентов по индексу в памяти процесса.
+Справочник ингредиентов небольшой и меняется редко, поэтому
+автодополнение отвечает из отсортированного массива названий
+без обращения к БД. Индекс строится при первом запросе и
+перестраивается, когда меняется версия справочника.
+Если совпадений по началу названия нет (обычно опечатка), ищутся
+похожие названия по триграммному индексу в памяти — в любой БД.
+Похожие названия ранжируются по сходству и по тому, как часто
+ингредиент встречается в рецептах. Частоты меняются с каждым
+рецептом, поэтому пересчитываются отдельно от индекса названий:
+при новой версии RECIPE_INGREDIENTS, но не чаще, чем раз
+в INGREDIENT_USAGE_REFRESH_INTERVAL секунд.
+"""
+import bisect
+import re
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db.models import Count
+
+from api.cache import INGREDIENTS, RECIPE_INGREDIENTS, VersionedSnapshot
+from api.serializers import IngredientSerializer
+from recipes.models import AmountOfIngredient, Ingredient
+
+
+def trigrams(text):
+    """ Триграммы строки по правилам pg_trgm: каждое слово
+    дополняется двумя пробелами в начале и одним в конце.
+    """
+    result = set()
+    for word in re.findall(r'\w+', text.casefold()):
+        padded = f'  {word} '
+        result.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return result
+
+
+class IngredientNames:
+    """ Названия ингредиентов: отсортированные ключи для поиска по
+    началу названия и триграммы для поиска похожих.
+    """
+
+    def __init__(self, ingredients):
+        rows = sorted(
+            ingredients,
+            key=lambda ingredient: (ingredient.name.casefold(), ingredient.id)
+        )
+        self.keys = [ingredient.name.casefold() for ingredient in rows]
+        self.items = IngredientSerializer(rows, many=True).data
+        self.grams = [trigrams(key) for key in self.keys]
+        self.postings = defaultdict(list)
+        for position, grams in enumerate(self.grams):
+            for gram in grams:
+                self.postings[gram].append(position)
+
+
+def load_usage():
+    """ Сколько раз каждый ингредиент встречается в рецептах. """
+    return dict(
+        AmountOfIngredient.objects.values_list('ingredient').annotate(
+            total=Count('id')
+        ).order_by()
+    )
+
+
+class IngredientIndex:
+
+    def __init__(self):
+        self.names = VersionedSnapshot(
+            (INGREDIENTS, ),
+            lambda: IngredientNames(Ingredient.objects.all())
+        )
+        self.usage = VersionedSnapshot(
+            (RECIPE_INGREDIENTS, ), load_usage,
+            interval='INGREDIENT_USAGE_REFRESH_INTERVAL'
+        )
+
+    def search(self, text, limit=None, fuzzy=True):
+        """ Совпадения по началу названия, а если их нет — похожие. """
+        results = self.prefix(text, limit)
+        if results or not fuzzy:
+            return results
+        return self.similar(text, limit)
+
+    def prefix(self, text, limit=None):
+        """ Ингредиенты, название которых начинается с text. """
+        state = self.names.get()
+        key = text.casefold()
+        start = bisect.bisect_left(state.keys, key)
+        end = start
+        stop = len(state.keys)
+        if limit is not None:
+            stop = min(stop, start + limit)
+        while end < stop and state.keys[end].startswith(key):
+            end += 1
+        return list(state.items[start:end])
+
+    def similar(self, text, limit=None):
+        """ Похожие названия по триграммному индексу в памяти. """
+        state = self.names.get()
+        usage = self.usage.get()
+        query = trigrams(text)
+        shared = Counter()
+        for gram in query:
+            shared.update(state.postings.get(gram, ()))
+        ranked = []
+        for position, common in shared.items():
+            similarity = common / (
+                len(query) + len(state.grams[position]) - common
+            )
+            if similarity >= settings.INGREDIENT_TRIGRAM_THRESHOLD:
+                ranked.append((
+                    -similarity,
+                    -usage.get(state.items[position]['id'], 0),
+                    position,
+                ))
+        ranked.sort()
+        return [state.items[position] for *_, position in ranked[:limit]]
+
+
+ingredient_index = IngredientIndex()
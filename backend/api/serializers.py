@@ -1,13 +1,51 @@
-from django.shortcuts import get_object_or_404
+from django.db import transaction
+from django.db.models import F
 from drf_extra_fields.fields import Base64ImageField
 from rest_framework import serializers
-
+from rest_framework.validators import UniqueValidator
+
+from api.cache import (FAVOURITES, RECIPE_INGREDIENTS, RECIPES, SHOPPING_CART,
+                       SUBSCRIPTIONS, bump_version, get_user_flags)
+from api.fields import StreamingBase64ImageField
+from api.thumbnails import release_images
+from api.thumbnails import schedule as schedule_thumbnails
+from api.thumbnails import thumbnail_urls
 from recipes.models import (AmountOfIngredient, Favourite, Ingredient, Recipe,
-                            ShoppingList, Tag)
+                            ShoppingCartIngredient, ShoppingList, Tag)
 from users.models import Subscribe, User
 
 
-class UserSerializer(serializers.ModelSerializer):
+def get_recipes_limit(request):
+    """ Значение параметра recipes_limit из запроса. """
+    limit = request.query_params.get('recipes_limit')
+    if not limit:
+        return None
+    try:
+        return max(int(limit), 0)
+    except ValueError as error:
+        raise TypeError(f'параметр "recipes_limit" содержит символы, '
+                        f'не являющиеся цифрами. '
+                        f'Возникла ошибка - {error}')
+
+
+class UserFlagsMixin:
+    """ Флаги избранного, списка покупок и подписок текущего пользователя.
+    Множества id берутся из кэша один раз на весь сериализуемый ответ.
+    """
+
+    def get_user_flags(self):
+        if 'user_flags' not in self.context:
+            self.context['user_flags'] = get_user_flags(
+                self.context.get('request').user
+            )
+        return self.context['user_flags']
+
+    def has_flag(self, kind, object_id):
+        flags = self.get_user_flags()
+        return flags is not None and object_id in flags[kind]
+
+
+class UserSerializer(UserFlagsMixin, serializers.ModelSerializer):
     """ Сериалайзер для предоставлении сведений о пользователе. """
 
     is_subscribed = serializers.SerializerMethodField()
@@ -19,10 +57,7 @@ class UserSerializer(serializers.ModelSerializer):
             'is_subscribed')
 
     def get_is_subscribed(self, obj):
-        request_user = self.context.get('request').user
-        if request_user.is_anonymous:
-            return False
-        return request_user.subscriber.filter(subscribing=obj).exists()
+        return self.has_flag(SUBSCRIPTIONS, obj.id)
 
 
 class SubscribeSerializer(serializers.ModelSerializer):
@@ -42,7 +77,7 @@ class SubscribeSerializer(serializers.ModelSerializer):
 class ShowSubscribeSerializer(UserSerializer):
     """ Сериалайзер для отображения подписки. """
     recipes = serializers.SerializerMethodField()
-    recipes_count = serializers.SerializerMethodField()
+    recipes_count = serializers.ReadOnlyField()
 
     class Meta:
         model = User
@@ -59,25 +94,19 @@ class ShowSubscribeSerializer(UserSerializer):
 
     def get_recipes(self, obj):
         request = self.context.get('request')
-        recipes = Recipe.objects.filter(author=obj)
-        limit = request.query_params.get('recipes_limit')
-        if limit:
-            try:
-                limit_number = int(limit)
-                recipes = recipes[:limit_number]
-            except Exception as error:
-                raise TypeError(f'параметр "recipes_limit" содержит символы, '
-                                f'не являющиеся цифрами. '
-                                f'Возникла ошибка - {error}')
+        recipes = self.context.get('recipes')
+        if recipes is not None:
+            recipes = recipes.get(obj.id, [])
+        else:
+            recipes = Recipe.objects.filter(author=obj)
+            limit = get_recipes_limit(request)
+            if limit is not None:
+                recipes = recipes[:limit]
         return ShortRecipeSerialiser(
             recipes,
             many=True,
             context={'request': request}).data
 
-    def get_recipes_count(self, obj):
-        recipes = Recipe.objects.filter(author=obj)
-        return recipes.count()
-
 
 class TagSerializer(serializers.ModelSerializer):
     """ Сериализатор для просмотра тегов """
@@ -140,7 +169,7 @@ class ShoppingSerializer(serializers.ModelSerializer):
         ).data
 
 
-class RecipeSerialiser(serializers.ModelSerializer):
+class RecipeSerialiser(UserFlagsMixin, serializers.ModelSerializer):
     """
     Сериалайзер для получения рецепта и списка рецептов.
     """
@@ -150,6 +179,7 @@ class RecipeSerialiser(serializers.ModelSerializer):
     is_in_shopping_cart = serializers.SerializerMethodField()
     ingredients = serializers.SerializerMethodField()
     image = Base64ImageField()
+    thumbnails = serializers.SerializerMethodField()
 
     class Meta:
         model = Recipe
@@ -160,6 +190,7 @@ class RecipeSerialiser(serializers.ModelSerializer):
             'is_in_shopping_cart',
             'name',
             'image',
+            'thumbnails',
             'text',
             'cooking_time',
             'id',
@@ -167,32 +198,18 @@ class RecipeSerialiser(serializers.ModelSerializer):
         )
 
     def get_is_favorited(self, obj):
-        request_user = self.context.get('request').user
-        if request_user.is_anonymous:
-            return False
-        return Favourite.objects.filter(
-            user=request_user.id,
-            recipe=obj.id
-        ).exists()
-
-    def get_is_subscribed(self, obj):
-        request_user = self.context.get('request').user
-        if request_user.is_anonymous:
-            return False
-        return request_user.subscriber.filter(subscribing=obj).exists()
+        return self.has_flag(FAVOURITES, obj.id)
 
     def get_is_in_shopping_cart(self, obj):
-        request_user = self.context.get('request').user
-        if request_user.is_anonymous:
-            return False
-        return ShoppingList.objects.filter(
-            user=request_user.id,
-            recipe=obj.id
-        ).exists()
+        return self.has_flag(SHOPPING_CART, obj.id)
+
+    def get_thumbnails(self, obj):
+        return thumbnail_urls(obj, self.context.get('request'))
 
     def get_ingredients(self, obj):
-        ingredients = AmountOfIngredient.objects.filter(recipe=obj)
-        return IngredientsinReciptSerializer(ingredients, many=True).data
+        return IngredientsinReciptSerializer(
+            obj.ingredients.all(), many=True
+        ).data
 
 
 class AddIngredientRecipeSerializer(serializers.ModelSerializer):
@@ -214,16 +231,39 @@ class AddIngredientRecipeSerializer(serializers.ModelSerializer):
         fields = ('id', 'amount')
 
 
+class ContextPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """ Ищет объект в словаре {pk: объект} из контекста сериализатора,
+    если он туда заранее положен, иначе — запросом к БД.
+    """
+
+    def __init__(self, context_key, **kwargs):
+        self.context_key = context_key
+        super().__init__(**kwargs)
+
+    def to_internal_value(self, data):
+        lookup = self.context.get(self.context_key)
+        if lookup is None:
+            return super().to_internal_value(data)
+        if isinstance(data, bool):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        try:
+            return lookup[int(data)]
+        except KeyError:
+            self.fail('does_not_exist', pk_value=data)
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+
+
 class RecipeCreateSerialiser(serializers.ModelSerializer):
     """
     Сериалайзер для создания и обновления рецепта.
     """
     author = UserSerializer(read_only=True)
     ingredients = AddIngredientRecipeSerializer(many=True)
-    tags = serializers.PrimaryKeyRelatedField(
-        queryset=Tag.objects.all(), many=True
+    tags = ContextPrimaryKeyRelatedField(
+        'tags', queryset=Tag.objects.all(), many=True
     )
-    image = Base64ImageField()
+    image = StreamingBase64ImageField()
     cooking_time = serializers.IntegerField()
 
     class Meta:
@@ -253,6 +293,21 @@ class RecipeCreateSerialiser(serializers.ModelSerializer):
             raise serializers.ValidationError(
                 'Нужен хотя бы один ингредиент!'
             )
+        ids = [ingredient['id'] for ingredient in ingredients]
+        if len(set(ids)) != len(ids):
+            raise serializers.ValidationError(
+                'Ингредиенты должны быть уникальными!'
+            )
+        found = self.context.get('ingredients')
+        if found is None:
+            found = Ingredient.objects.in_bulk(ids)
+        missing = [str(pk) for pk in ids if pk not in found]
+        if missing:
+            raise serializers.ValidationError(
+                f'Ингредиенты не найдены: {", ".join(missing)}.'
+            )
+        for ingredient in ingredients:
+            ingredient['ingredient'] = found[ingredient['id']]
         return value
 
     def validate_tags(self, value):
@@ -274,49 +329,135 @@ class RecipeCreateSerialiser(serializers.ModelSerializer):
         ingredients, tags = (
             validated_data.pop('ingredients'), validated_data.pop('tags')
         )
-
-        for ingredient in ingredients:
-            amount_of_ingredient, flag = (
-                AmountOfIngredient.objects.get_or_create(
-                    ingredient=get_object_or_404(
-                        Ingredient,
-                        pk=ingredient['id']
-                    ),
-                    amount=ingredient['amount'],
-                    recipe=instance
-                )
+        AmountOfIngredient.objects.bulk_create(
+            AmountOfIngredient(
+                recipe=instance,
+                ingredient=ingredient['ingredient'],
+                amount=ingredient['amount'],
             )
-            instance.ingredients.add(amount_of_ingredient)
-        for tag in tags:
-            instance.tags.add(tag)
+            for ingredient in ingredients
+        )
+        instance.tags.set(tags)
         return instance
 
+    def update_ingredients(self, instance, ingredients):
+        """ Применяет к ингредиентам рецепта только разницу:
+        удаляет лишние строки, меняет количества, добавляет новые.
+        Возвращает прежние и новые количества по ингредиентам.
+        """
+        current = {
+            amount.ingredient_id: amount
+            for amount in AmountOfIngredient.objects.filter(recipe=instance)
+        }
+        new = {
+            ingredient['ingredient'].id: ingredient
+            for ingredient in ingredients
+        }
+        # Прежние количества — до того, как цикл ниже изменит строки.
+        old_totals = {
+            ingredient_id: amount.amount
+            for ingredient_id, amount in current.items()
+        }
+        removed = [
+            amount.id for ingredient_id, amount in current.items()
+            if ingredient_id not in new
+        ]
+        changed, created = [], []
+        for ingredient_id, ingredient in new.items():
+            amount = current.get(ingredient_id)
+            if amount is None:
+                created.append(AmountOfIngredient(
+                    recipe=instance,
+                    ingredient=ingredient['ingredient'],
+                    amount=ingredient['amount'],
+                ))
+            elif amount.amount != ingredient['amount']:
+                amount.amount = ingredient['amount']
+                changed.append(amount)
+        if removed:
+            AmountOfIngredient.objects.filter(id__in=removed).delete()
+        AmountOfIngredient.objects.bulk_update(changed, ('amount', ))
+        AmountOfIngredient.objects.bulk_create(created)
+        return old_totals, {
+            ingredient_id: ingredient['amount']
+            for ingredient_id, ingredient in new.items()
+        }
+
+    def save(self, **kwargs):
+        # Временный файл изображения хранилище перемещает на место,
+        # поэтому закрывается он явно, а не при сборке мусора.
+        try:
+            return super().save(**kwargs)
+        finally:
+            image = self.validated_data.get('image')
+            if image is not None:
+                image.close()
+
+    @transaction.atomic
     def create(self, validated_data):
         saved = {}
         saved['ingredients'] = validated_data.pop('ingredients')
         saved['tags'] = validated_data.pop('tags')
         author = self.context.get('request').user
         recipe = Recipe.objects.create(author=author, **validated_data)
+        User.objects.filter(id=author.id).update(
+            recipes_count=F('recipes_count') + 1
+        )
+        schedule_thumbnails([recipe])
         return self.create_ingredients_and_tags(recipe, saved)
 
+    @staticmethod
+    def same_image(instance, image):
+        """ Совпадает ли загруженное изображение с текущим.
+        Имя файла в хранилище — хэш содержимого, поэтому сравниваются
+        имена, без чтения текущего файла.
+        """
+        if not instance.image:
+            return False
+        field = instance.image.field
+        name = field.storage.content_name(
+            field.generate_filename(instance, image.name), image
+        )
+        return name == instance.image.name
+
+    @transaction.atomic
     def update(self, instance, validated_data):
+        old_image = instance.image.name
+        image_changed = 'image' in validated_data and not self.same_image(
+            instance, validated_data['image']
+        )
         instance.name = validated_data.get('name', instance.name)
-        instance.image = validated_data.get('image', instance.image)
+        if image_changed:
+            instance.image = validated_data['image']
+            instance.thumbnails = {}
         instance.text = validated_data.get('text', instance.text)
         instance.cooking_time = validated_data.get(
             'cooking_time',
             instance.cooking_time
         )
-        instance.tags.clear()
-        AmountOfIngredient.objects.filter(recipe_id=instance).delete()
-        saved = {}
-        saved['ingredients'] = validated_data.pop('ingredients')
-        saved['tags'] = validated_data.pop('tags')
-        self.create_ingredients_and_tags(instance, saved)
+        if 'tags' in validated_data:
+            instance.tags.set(validated_data.pop('tags'))
+        if 'ingredients' in validated_data:
+            # Блокировка строки рецепта до конца транзакции: иначе два
+            # параллельных изменения прочитали бы одни и те же прежние
+            # количества и дважды перенесли разницу в списки покупок.
+            Recipe.objects.select_for_update().only('id').get(pk=instance.pk)
+            old_totals, new_totals = self.update_ingredients(
+                instance, validated_data.pop('ingredients')
+            )
+            ShoppingCartIngredient.objects.change_recipe(
+                instance.id, old_totals, new_totals
+            )
         instance.save()
+        if image_changed:
+            schedule_thumbnails([instance])
+            release_images([old_image])
         return instance
 
     def to_representation(self, instance):
+        # Ингредиенты и теги записаны пакетно, поэтому рецепт читается
+        # заново вместе со связанными объектами.
+        instance = Recipe.objects.with_related().get(pk=instance.pk)
         return RecipeSerialiser(instance, context={
             'request': self.context.get('request')
         }).data
@@ -326,6 +467,129 @@ class ShortRecipeSerialiser(serializers.ModelSerializer):
     """
     Сериалайзер для представления кратких сведений рецепта.
     """
+    thumbnails = serializers.SerializerMethodField()
+
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'thumbnails', 'cooking_time')
+
+    def get_thumbnails(self, obj):
+        return thumbnail_urls(obj, self.context.get('request'))
+
+
+def primary_keys(values):
+    """ Значения, похожие на целые id; остальные отсеет валидация. """
+    keys = set()
+    for value in values:
+        if isinstance(value, bool):
+            continue
+        try:
+            keys.add(int(value))
+        except (TypeError, ValueError):
+            continue
+    return keys
+
+
+class RecipeBatchItemSerializer(RecipeCreateSerialiser):
+    """ Рецепт из пакетной загрузки.
+    Теги, ингредиенты и занятые названия берутся из контекста, где они
+    собраны одним запросом на весь пакет, а запись выполняет
+    bulk_create.
+    """
+
+    def get_fields(self):
+        fields = super().get_fields()
+        fields['name'].validators = [
+            validator for validator in fields['name'].validators
+            if not isinstance(validator, UniqueValidator)
+        ]
+        return fields
+
+    def validate_name(self, value):
+        if value in self.context['taken_names']:
+            raise serializers.ValidationError(
+                'Рецепт с таким названием уже существует.'
+            )
+        return value
+
+    def validate(self, attrs):
+        # Название занимается только рецептом, прошедшим валидацию.
+        self.context['taken_names'].add(attrs['name'])
+        return attrs
+
+    @staticmethod
+    def get_batch_context(items, request):
+        """ Контекст пакета: теги и ингредиенты всех рецептов одним
+        запросом на каждую модель и уже занятые названия.
+        """
+        tag_ids, ingredient_ids, names = [], [], set()
+        for item in items:
+            if not isinstance(item, dict):
+                continue
+            tags = item.get('tags')
+            if isinstance(tags, list):
+                tag_ids.extend(tags)
+            ingredients = item.get('ingredients')
+            if isinstance(ingredients, list):
+                ingredient_ids.extend(
+                    ingredient.get('id') for ingredient in ingredients
+                    if isinstance(ingredient, dict)
+                )
+            if isinstance(item.get('name'), str):
+                names.add(item['name'])
+        return {
+            'request': request,
+            'tags': Tag.objects.in_bulk(primary_keys(tag_ids)),
+            'ingredients': Ingredient.objects.in_bulk(
+                primary_keys(ingredient_ids)
+            ),
+            'taken_names': set(Recipe.objects.filter(
+                name__in=names
+            ).values_list('name', flat=True)),
+        }
+
+    @staticmethod
+    @transaction.atomic
+    def bulk_create(items, author):
+        """ Создаёт рецепты по провалидированным данным
+        и возвращает их id в порядке items.
+        """
+        recipes = Recipe.objects.bulk_create(
+            Recipe(
+                author=author,
+                **{
+                    field: value for field, value in item.items()
+                    if field not in ('ingredients', 'tags')
+                }
+            )
+            for item in items
+        )
+        if recipes and recipes[0].pk is None:
+            # Не все БД возвращают id из пакетной вставки: рецепты
+            # находятся по уникальному названию.
+            ids = dict(Recipe.objects.filter(
+                name__in=[recipe.name for recipe in recipes]
+            ).values_list('name', 'id'))
+            for recipe in recipes:
+                recipe.pk = ids[recipe.name]
+        AmountOfIngredient.objects.bulk_create(
+            AmountOfIngredient(
+                recipe=recipe,
+                ingredient=ingredient['ingredient'],
+                amount=ingredient['amount'],
+            )
+            for recipe, item in zip(recipes, items)
+            for ingredient in item['ingredients']
+        )
+        Recipe.tags.through.objects.bulk_create(
+            Recipe.tags.through(recipe=recipe, tag=tag)
+            for recipe, item in zip(recipes, items)
+            for tag in item['tags']
+        )
+        User.objects.filter(id=author.id).update(
+            recipes_count=F('recipes_count') + len(recipes)
+        )
+        transaction.on_commit(lambda: bump_version(RECIPES))
+        transaction.on_commit(lambda: bump_version(RECIPE_INGREDIENTS))
+        schedule_thumbnails(recipes)
+        return [recipe.pk for recipe in recipes]
@@ -0,0 +1,69 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from api.cache import (INGREDIENTS, RECIPE_INGREDIENTS, RECIPES, TAGS,
+                       bump_version, invalidate_user_flags)
+from api.thumbnails import release_images
+from recipes.models import Favourite, Ingredient, Recipe, ShoppingList, Tag
+from users.models import Subscribe, User
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def ingredients_changed(**kwargs):
+    bump_version(INGREDIENTS)
+    # Удаление ингредиента удаляет его из рецептов.
+    bump_version(RECIPE_INGREDIENTS)
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def tags_changed(**kwargs):
+    bump_version(TAGS)
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def recipes_changed(**kwargs):
+    # Версия меняется после фиксации транзакции: иначе параллельный
+    # запрос успел бы закэшировать старые данные под новой версией.
+    transaction.on_commit(recipes_written)
+
+
+def recipes_written():
+    bump_version(RECIPES)
+    bump_version(RECIPE_INGREDIENTS)
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_image_released(instance, **kwargs):
+    release_images([instance.image.name])
+
+
+@receiver(post_save, sender=User)
+def author_changed(instance, created, update_fields=None, **kwargs):
+    """ Данные автора входят в ответ рецепта. """
+    if created or update_fields == frozenset({'last_login'}):
+        return
+    Recipe.objects.filter(author=instance).update(updated_at=timezone.now())
+    transaction.on_commit(lambda: bump_version(RECIPES))
+
+
+@receiver(post_save, sender=Favourite)
+@receiver(post_delete, sender=Favourite)
+@receiver(post_save, sender=ShoppingList)
+@receiver(post_delete, sender=ShoppingList)
+def user_lists_changed(instance, **kwargs):
+    # Как и версии рецептов — после фиксации: иначе параллельный
+    # запрос успел бы загрузить в кэш множества без этой записи.
+    user_id = instance.user_id
+    transaction.on_commit(lambda: invalidate_user_flags(user_id))
+
+
+@receiver(post_save, sender=Subscribe)
+@receiver(post_delete, sender=Subscribe)
+def subscriptions_changed(instance, **kwargs):
+    subscriber_id = instance.subscriber_id
+    transaction.on_commit(lambda: invalidate_user_flags(subscriber_id))
@@ -0,0 +1,145 @@
+""" Миниатюры изображений рецептов.
+Оригинал сохраняется в запросе как есть, а миниатюры фиксированных
+размеров (RECIPE_THUMBNAILS) готовит sorl.thumbnail в фоновом пуле
+потоков после фиксации транзакции. Имена готовых файлов записываются
+в Recipe.thumbnails; пока их нет, клиент получает оригинал.
+Одно изображение может принадлежать нескольким рецептам (хранилище
+адресуется по содержимому), поэтому файл вместе с миниатюрами
+удаляется, только когда на него не ссылается ни один рецепт.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from sorl.thumbnail import delete, get_thumbnail
+from sorl.thumbnail.images import ImageFile
+
+from api.cache import RECIPES, bump_version
+from recipes.models import Recipe
+
+logger = logging.getLogger(__name__)
+
+
+def generate(recipe_id, image_name):
+    """ Готовит все миниатюры рецепта и записывает их имена,
+    если изображение рецепта за это время не заменили.
+    """
+    close_old_connections()
+    try:
+        recipe = Recipe.objects.only('image').filter(
+            pk=recipe_id, image=image_name
+        ).first()
+        if recipe is None:
+            return
+        thumbnails = {
+            name: get_thumbnail(recipe.image, **options).name
+            for name, options in settings.RECIPE_THUMBNAILS.items()
+        }
+        updated = Recipe.objects.filter(
+            pk=recipe_id, image=image_name
+        ).update(thumbnails=thumbnails, updated_at=timezone.now())
+        if updated:
+            bump_version(RECIPES)
+    except Exception:
+        logger.exception('Миниатюры рецепта %s не созданы', recipe_id)
+    finally:
+        close_old_connections()
+
+
+class ThumbnailPool:
+    """ Пул потоков для миниатюр, создаётся при первой задаче. """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.executor = None
+        # Задачи, отложенные до wait() при RECIPE_THUMBNAILS_ASYNC = False.
+        self.pending = []
+
+    def submit(self, recipe_id, image_name):
+        if not settings.RECIPE_THUMBNAILS_ASYNC:
+            self.pending.append((recipe_id, image_name))
+            return
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(
+                    max_workers=settings.RECIPE_THUMBNAIL_WORKERS,
+                    thread_name_prefix='thumbnails',
+                )
+            self.executor.submit(generate, recipe_id, image_name)
+
+    def wait(self):
+        """ Выполняет отложенные задачи и дожидается запущенных;
+        следующая задача создаст новый пул.
+        """
+        pending, self.pending = self.pending, []
+        for recipe_id, image_name in pending:
+            generate(recipe_id, image_name)
+        with self.lock:
+            executor, self.executor = self.executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+
+thumbnail_pool = ThumbnailPool()
+
+
+def schedule(recipes):
+    """ Ставит миниатюры рецептов в очередь после фиксации транзакции. """
+    jobs = [(recipe.pk, recipe.image.name) for recipe in recipes
+            if recipe.image]
+
+    def submit():
+        for recipe_id, image_name in jobs:
+            thumbnail_pool.submit(recipe_id, image_name)
+
+    if jobs:
+        transaction.on_commit(submit)
+
+
+def thumbnail_urls(recipe, request=None):
+    """ Ссылки на миниатюры; для ещё не готовых — ссылка на оригинал. """
+    if not recipe.image:
+        return {name: None for name in settings.RECIPE_THUMBNAILS}
+    ready = recipe.thumbnails or {}
+    urls = {}
+    for name in settings.RECIPE_THUMBNAILS:
+        url = (
+            default_storage.url(ready[name]) if name in ready
+            else recipe.image.url
+        )
+        urls[name] = request.build_absolute_uri(url) if request else url
+    return urls
+
+
+def release_images(names):
+    """ После фиксации транзакции удаляет изображения, на которые
+    больше не ссылается ни один рецепт, и их миниатюры. Файлы, которые
+    только что сохраняли (RECIPE_IMAGE_RELEASE_GRACE), остаются:
+    их может использовать ещё не зафиксированный рецепт.
+    """
+    names = {name for name in names if name}
+
+    def release():
+        used = set(Recipe.objects.filter(
+            image__in=names
+        ).values_list('image', flat=True))
+        storage = Recipe._meta.get_field('image').storage
+        fresh = timezone.now() - timedelta(
+            seconds=settings.RECIPE_IMAGE_RELEASE_GRACE
+        )
+        for name in names - used:
+            try:
+                if (storage.exists(name)
+                        and storage.get_modified_time(name) > fresh):
+                    continue
+                delete(ImageFile(name, storage))
+            except Exception:
+                logger.exception('Изображение %s не удалено', name)
+
+    if names:
+        transaction.on_commit(release)
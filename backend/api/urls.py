@@ -1,9 +1,9 @@
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 
-from api.views import (DownloadShoppingCartApiView, FavouriteApiView,
-                       IngredientViewSet, RecipeViewSet, ShoppingApiView,
-                       TagViewSet)
+from api.views import (CacheStatsApiView, DownloadShoppingCartApiView,
+                       FavouriteApiView, IngredientViewSet, RecipeViewSet,
+                       ShoppingApiView, TagViewSet)
 
 
 app_name = 'api'
@@ -18,5 +18,6 @@ urlpatterns = [
          DownloadShoppingCartApiView.as_view()),
     path('recipes/<int:id>/favorite/', FavouriteApiView.as_view()),
     path('recipes/<int:id>/shopping_cart/', ShoppingApiView.as_view()),
+    path('cache/stats/', CacheStatsApiView.as_view()),
     path('', include(router.urls)),
 ]
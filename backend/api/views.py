@@ -1,35 +1,86 @@
-from django.db.models import Sum
-from django.http import HttpResponse
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Max
+from django.http import HttpResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.views import UserViewSet
 from rest_framework import permissions, status, viewsets
 from rest_framework.decorators import action
+from rest_framework.negotiation import DefaultContentNegotiation
 from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 from rest_framework.views import APIView
 
+from api import export
+from api.cache import (INGREDIENTS, RECIPES, SUBSCRIPTIONS, TAGS,
+                       PrerenderedPayload, get_changed_at, get_stats,
+                       get_user_flags, get_version, make_etag)
+from api.feed import feed_ids
 from api.filters import IngredientFilter, RecipeFilter
 from api.pagination import CustomPagination
 from api.permissions import AuthorAdminAndReadPermission, CustomUserPermission
+from api.search import ingredient_index
 from api.serializers import (FavouriteSerializer, IngredientSerializer,
-                             RecipeCreateSerialiser, RecipeSerialiser,
-                             ShoppingSerializer, SubscribeSerializer,
-                             TagSerializer)
-from users.models import Subscribe
-from recipes.models import (AmountOfIngredient, Favourite, Ingredient, Recipe,
-                            ShoppingList, Tag)
+                             RecipeBatchItemSerializer, RecipeCreateSerialiser,
+                             RecipeSerialiser, ShoppingSerializer,
+                             ShortRecipeSerialiser, ShowSubscribeSerializer,
+                             SubscribeSerializer, TagSerializer,
+                             get_recipes_limit)
+from users.models import Subscribe, User
+from recipes.models import (Favourite, Ingredient, Recipe, RecipeTrend,
+                            ShoppingCartIngredient, ShoppingList, Tag,
+                            recipe_totals)
 
 
-class TagViewSet(viewsets.ReadOnlyModelViewSet):
+class PrerenderedListMixin:
+    """ Список отдаётся готовыми байтами JSON со строгим ETag;
+    при совпадении If-None-Match возвращается 304 без тела.
+    """
+    payload = None
+
+    def prerendered_list(self, request):
+        etag, body = self.payload.get()
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = HttpResponse(body, content_type='application/json')
+        response['ETag'] = etag
+        return response
+
+
+class TagViewSet(PrerenderedListMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
+    payload = PrerenderedPayload(
+        TAGS, lambda: TagSerializer(Tag.objects.all(), many=True).data
+    )
+
+    def list(self, request, *args, **kwargs):
+        return self.prerendered_list(request)
 
 
-class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
+class IngredientViewSet(PrerenderedListMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     filter_backends = (IngredientFilter, )
     search_fields = ('^name', )
+    payload = PrerenderedPayload(
+        INGREDIENTS,
+        lambda: IngredientSerializer(Ingredient.objects.all(), many=True).data
+    )
+
+    def list(self, request, *args, **kwargs):
+        name = request.query_params.get(IngredientFilter.search_param)
+        if name:
+            fuzzy = request.query_params.get(
+                'fuzzy', str(int(settings.INGREDIENT_FUZZY_SEARCH))
+            )
+            return Response(ingredient_index.search(
+                name, settings.INGREDIENT_SEARCH_LIMIT, fuzzy=fuzzy != '0'
+            ))
+        return self.prerendered_list(request)
 
 
 class FavouriteApiView(APIView):
@@ -48,7 +99,15 @@ class FavouriteApiView(APIView):
                 data=data, context={'request': request}
             )
             if serializer.is_valid():
-                serializer.save()
+                try:
+                    with transaction.atomic():
+                        serializer.save()
+                        Recipe.objects.filter(id=id).update(
+                            favourites_count=F('favourites_count') + 1
+                        )
+                except IntegrityError:
+                    # Параллельный запрос уже добавил этот рецепт.
+                    return Response(status=status.HTTP_400_BAD_REQUEST)
                 return Response(
                     serializer.data, status=status.HTTP_201_CREATED)
         return Response(status=status.HTTP_400_BAD_REQUEST)
@@ -56,7 +115,13 @@ class FavouriteApiView(APIView):
     def delete(self, request, id):
         recipe = get_object_or_404(Recipe, id=id)
         if Favourite.objects.filter(user=request.user, recipe=recipe).exists():
-            Favourite.objects.filter(user=request.user, recipe=recipe).delete()
+            with transaction.atomic():
+                deleted, _ = Favourite.objects.filter(
+                    user=request.user, recipe=recipe
+                ).delete()
+                Recipe.objects.filter(
+                    id=recipe.id, favourites_count__gte=deleted
+                ).update(favourites_count=F('favourites_count') - deleted)
             return Response(status=status.HTTP_204_NO_CONTENT)
         return Response(status=status.HTTP_400_BAD_REQUEST)
 
@@ -77,7 +142,15 @@ class ShoppingApiView(APIView):
                 data=data, context={'request': request}
             )
             if serializer.is_valid():
-                serializer.save()
+                try:
+                    with transaction.atomic():
+                        serializer.save()
+                        ShoppingCartIngredient.objects.add_recipe(
+                            request.user.id, id
+                        )
+                except IntegrityError:
+                    # Параллельный запрос уже добавил этот рецепт.
+                    return Response(status=status.HTTP_400_BAD_REQUEST)
                 return Response(
                     serializer.data, status=status.HTTP_201_CREATED)
         return Response(status=status.HTTP_400_BAD_REQUEST)
@@ -88,10 +161,14 @@ class ShoppingApiView(APIView):
             user=request.user,
             recipe=recipe
         ).exists():
-            ShoppingList.objects.filter(
-                user=request.user,
-                recipe=recipe
-            ).delete()
+            with transaction.atomic():
+                ShoppingList.objects.filter(
+                    user=request.user,
+                    recipe=recipe
+                ).delete()
+                ShoppingCartIngredient.objects.add_recipe(
+                    request.user.id, recipe.id, sign=-1
+                )
             return Response(status=status.HTTP_204_NO_CONTENT)
         return Response(status=status.HTTP_400_BAD_REQUEST)
 
@@ -103,10 +180,16 @@ class RecipeViewSet(viewsets.ModelViewSet):
     queryset = Recipe.objects.all()
     serializer_class = RecipeSerialiser
     pagination_class = CustomPagination
+    cursor_pagination_actions = ('list', )
+    # Поиск упорядочен по релевантности, а курсор — по id.
+    cursor_pagination_conflicts = ('search', )
     permission_classes = (AuthorAdminAndReadPermission, )
     filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipeFilter
 
+    def get_queryset(self):
+        return Recipe.objects.with_related()
+
     def get_serializer_class(self):
         if self.request.method == 'GET':
             return RecipeSerialiser
@@ -115,43 +198,324 @@ class RecipeViewSet(viewsets.ModelViewSet):
     def get_serializer_context(self):
         context = super().get_serializer_context()
         context.update({'request': self.request})
+        if hasattr(self, 'user_flags'):
+            context['user_flags'] = self.user_flags
         return context
 
+    def get_etag(self, *parts):
+        """ ETag ответа: версии справочников, версия множеств id
+        зрителя (флаги избранного, покупок и подписок) и части,
+        описывающие сам ответ.
+        """
+        self.user_flags = get_user_flags(self.request.user)
+        viewer = 'anonymous'
+        if self.user_flags is not None:
+            viewer = f'{self.request.user.id}:{self.user_flags["version"]}'
+        return make_etag(
+            get_version(TAGS), get_version(INGREDIENTS), viewer, *parts
+        )
+
+    def conditional(self, request, etag, last_modified, render):
+        """ 304 без сериализации, если версия у клиента совпадает. """
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified
+        )
+        if response is None:
+            response = render()
+        if response.status_code in (200, 304):
+            response['ETag'] = etag
+            if last_modified is not None:
+                response['Last-Modified'] = http_date(last_modified)
+            patch_vary_headers(response, ('Authorization', 'Cookie'))
+        return response
+
+    def list(self, request, *args, **kwargs):
+        etag = self.get_etag(get_version(RECIPES), request.get_full_path())
+        return self.conditional(
+            request, etag, None,
+            lambda: super(RecipeViewSet, self).list(request, *args, **kwargs)
+        )
+
+    @action(detail=False)
+    def trending(self, request):
+        """ Популярные рецепты по убыванию популярности, которую
+        периодически пересчитывает команда update_trending. Фильтры и
+        пагинация — как у списка рецептов.
+        """
+        # Версия популярности — время последнего пересчёта из БД:
+        # команда update_trending работает в другом процессе.
+        computed_at = RecipeTrend.objects.aggregate(
+            last=Max('computed_at')
+        )['last']
+        etag = self.get_etag(
+            get_version(RECIPES), computed_at, request.get_full_path()
+        )
+        return self.conditional(
+            request, etag, None, lambda: self.trending_page(request)
+        )
+
+    def trending_page(self, request):
+        queryset = self.filter_queryset(self.get_queryset()).filter(
+            trend__isnull=False
+        ).order_by('-trend__score', '-id')
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(
+                self.get_serializer(page, many=True).data
+            )
+        return Response(self.get_serializer(queryset, many=True).data)
+
+    @action(
+        detail=False, permission_classes=(permissions.IsAuthenticated, )
+    )
+    def feed(self, request):
+        """ Рецепты авторов из подписок, новые первыми. Пагинация по
+        ключу: ссылка next ведёт на рецепты с id меньше последнего.
+        """
+        try:
+            before = request.query_params.get('before')
+            before = int(before) if before else None
+            limit = int(request.query_params.get(
+                'limit', settings.FEED_PAGE_SIZE
+            ))
+        except ValueError:
+            return Response(
+                {'errors': 'before и limit должны быть числами.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        limit = min(max(limit, 1), settings.FEED_MAX_PAGE_SIZE)
+        etag = self.get_etag(get_version(RECIPES), request.get_full_path())
+        return self.conditional(
+            request, etag, None,
+            lambda: self.feed_page(request, before, limit)
+        )
+
+    def feed_page(self, request, before, limit):
+        ids = feed_ids(self.user_flags[SUBSCRIPTIONS], before, limit + 1)
+        page = ids[:limit]
+        recipes = Recipe.objects.with_related().in_bulk(page)
+        next_url = None
+        if len(ids) > limit:
+            next_url = replace_query_param(
+                request.build_absolute_uri(), 'before', page[-1]
+            )
+        return Response({
+            'next': next_url,
+            'results': self.get_serializer(
+                [recipes[pk] for pk in page if pk in recipes], many=True
+            ).data,
+        })
+
+    def retrieve(self, request, *args, **kwargs):
+        try:
+            updated_at = Recipe.objects.filter(
+                pk=kwargs[self.lookup_field]
+            ).values_list('updated_at', flat=True).first()
+        except (TypeError, ValueError):
+            updated_at = None
+        if updated_at is None:
+            return super().retrieve(request, *args, **kwargs)
+        etag = self.get_etag(kwargs[self.lookup_field], updated_at)
+        # Ответ зрителю зависит и от его избранного и списка покупок,
+        # которые не меняют updated_at: для него валидатор — только ETag.
+        # Для анонима ответ меняется с рецептом и со справочниками
+        # тегов и ингредиентов, как и ETag.
+        last_modified = None
+        if self.user_flags is None:
+            last_modified = int(max(
+                updated_at.timestamp(),
+                get_changed_at(TAGS),
+                get_changed_at(INGREDIENTS),
+            ))
+        return self.conditional(
+            request, etag, last_modified,
+            lambda: super(RecipeViewSet, self).retrieve(
+                request, *args, **kwargs
+            )
+        )
+
+    @action(detail=False, methods=('post', ))
+    def batch(self, request):
+        """ Пакетное создание рецептов: все рецепты валидируются заранее,
+        корректные записываются пакетными вставками в одной транзакции.
+        Для каждого рецепта возвращается результат или ошибки.
+        Пределы размера пакета — в get_body_max_size и batch_error.
+        """
+        error = self.batch_error(request)
+        if error is not None:
+            return error
+        items = request.data
+        context = RecipeBatchItemSerializer.get_batch_context(items, request)
+        results, valid = [], []
+        for index, item in enumerate(items):
+            serializer = RecipeBatchItemSerializer(data=item, context=context)
+            if serializer.is_valid():
+                valid.append((index, serializer.validated_data))
+                results.append(None)
+            else:
+                results.append({
+                    'index': index,
+                    'status': status.HTTP_400_BAD_REQUEST,
+                    'errors': serializer.errors,
+                })
+        if valid:
+            try:
+                ids = RecipeBatchItemSerializer.bulk_create(
+                    [data for _, data in valid], request.user
+                )
+            finally:
+                for _, data in valid:
+                    data['image'].close()
+            recipes = Recipe.objects.with_related().in_bulk(ids)
+            data = RecipeSerialiser(
+                [recipes[pk] for pk in ids], many=True,
+                context=self.get_serializer_context()
+            ).data
+            for (index, _), recipe in zip(valid, data):
+                results[index] = {
+                    'index': index,
+                    'status': status.HTTP_201_CREATED,
+                    'data': recipe,
+                }
+        if len(valid) == len(items):
+            code = status.HTTP_201_CREATED
+        elif valid:
+            code = status.HTTP_207_MULTI_STATUS
+        else:
+            code = status.HTTP_400_BAD_REQUEST
+        return Response(results, status=code)
+
+    def get_body_max_size(self):
+        """ Предел тела JSON для LimitedJSONParser: пакет рецептов
+        разбирается в памяти целиком, поэтому его предел свой.
+        """
+        if self.action == 'batch':
+            return settings.RECIPE_BATCH_MAX_BODY_SIZE
+        return settings.DATA_UPLOAD_MAX_MEMORY_SIZE
+
+    def batch_error(self, request):
+        """ Ответ с ошибкой, если пакет не список или слишком велик. """
+        items = request.data
+        if not isinstance(items, list) or not items:
+            return Response(
+                {'errors': 'Ожидается непустой список рецептов.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if len(items) > settings.RECIPE_BATCH_MAX_SIZE:
+            return Response(
+                {'errors': f'В пакете не больше '
+                           f'{settings.RECIPE_BATCH_MAX_SIZE} рецептов.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return None
+
+    @action(detail=True)
+    def similar(self, request, pk=None):
+        """ Похожие рецепты, самые близкие первыми. Списки посчитаны
+        командой build_similar_recipes и читаются одним запросом по
+        индексу (рецепт, сходство).
+        """
+        try:
+            limit = int(request.query_params.get(
+                'limit', settings.SIMILAR_RECIPES_TOP_K
+            ))
+            recipes = list(Recipe.objects.filter(
+                similar_to__recipe_id=pk
+            ).order_by('-similar_to__score', '-id')[:max(limit, 0)])
+        except (TypeError, ValueError):
+            return Response(
+                {'errors': 'id рецепта и limit должны быть числами.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if not recipes:
+            get_object_or_404(Recipe, pk=pk)
+        return Response(ShortRecipeSerialiser(
+            recipes, many=True, context=self.get_serializer_context()
+        ).data)
+
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        # Как при изменении ингредиентов: количества не должны
+        # поменяться между чтением и вычитанием из списков покупок.
+        Recipe.objects.select_for_update().only('id').get(pk=instance.pk)
+        ShoppingCartIngredient.objects.change_recipe(
+            instance.id, recipe_totals(instance.id), {}
+        )
+        instance.delete()
+        User.objects.filter(
+            id=instance.author_id, recipes_count__gt=0
+        ).update(recipes_count=F('recipes_count') - 1)
+
+
+class IgnoreFormatNegotiation(DefaultContentNegotiation):
+    """ Параметр format означает формат файла, а не рендерер DRF. """
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        return renderers[0], renderers[0].media_type
+
 
 class DownloadShoppingCartApiView(APIView):
-    """ Скачивание ингридиентов из рецептов списка покупок. """
+    """ Скачивание ингридиентов из рецептов списка покупок.
+    Формат задаётся параметром format: txt (по умолчанию), csv или pdf.
+    """
 
     permission_classes = (permissions.IsAuthenticated, )
+    content_negotiation_class = IgnoreFormatNegotiation
 
     def get(self, request):
         request_user = request.user
-        ingredients = AmountOfIngredient.objects.filter(
-            recipe__shopping_list__user=request_user).values(
-            'ingredient__name',
-            'ingredient__measurement_unit'
-        ).annotate(amount=Sum('amount'))
-
-        shopping_list = 'Список покупок \n'
-
-        shopping_list += '\n'.join([
-            f'- {ingredient["ingredient__name"]} '
-            f'({ingredient["ingredient__measurement_unit"]})'
-            f' - {ingredient["amount"]}'
-            for ingredient in ingredients
-        ])
-
-        filename = f'{request_user.username}_shopping_list.txt'
-        response = HttpResponse(shopping_list, content_type='text/plain')
+        file_format = request.query_params.get('format', 'txt')
+        if file_format not in export.FORMATS:
+            return Response(
+                {'errors': f'Формат должен быть одним из: '
+                           f'{", ".join(export.FORMATS)}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if file_format == 'pdf':
+            try:
+                version, pdf = export.get_pdf(request_user)
+            except export.RenderError as error:
+                return Response(
+                    {'errors': str(error)},
+                    status=status.HTTP_503_SERVICE_UNAVAILABLE
+                )
+            response = get_conditional_response(request, etag=version)
+            if response is None:
+                response = HttpResponse(pdf, content_type='application/pdf')
+            response['ETag'] = version
+        elif file_format == 'csv':
+            response = StreamingHttpResponse(
+                export.stream_csv(request_user),
+                content_type='text/csv; charset=utf-8'
+            )
+        else:
+            response = StreamingHttpResponse(
+                export.stream_txt(request_user), content_type='text/plain'
+            )
+
+        filename = f'{request_user.username}_shopping_list.{file_format}'
         response['Content-Disposition'] = f'attachment; filename={filename}'
         return response
 
 
+class CacheStatsApiView(APIView):
+    """ Попадания и промахи кэша флагов пользователя в этом процессе. """
+
+    permission_classes = (permissions.IsAdminUser, )
+
+    def get(self, request):
+        return Response({'user_flags': get_stats()})
+
+
 class CustomUserViewSet(UserViewSet):
     """ Получение пользователем сведений о своих подписках.
     Добавление/удаление подписки на автора.
     """
     pagination_class = CustomPagination
     permission_classes = (CustomUserPermission, )
+    cursor_pagination_actions = ('subscriptions', )
+    # Авторы в порядке подписки, как и на страницах по номеру.
+    cursor_ordering = 'subscription_id'
 
     @action(
         methods=['GET'],
@@ -159,14 +523,34 @@ class CustomUserViewSet(UserViewSet):
         permission_classes=(permissions.IsAuthenticated, )
     )
     def subscriptions(self, request):
-        request_user = request.user
-        queryset = Subscribe.objects.filter(subscriber=request_user)
-        page = self.paginate_queryset(queryset)
-        serializer = SubscribeSerializer(
-            page, many=True, context={'request': request}
+        page = self.paginate_queryset(self.get_subscribed_authors(request))
+        serializer = ShowSubscribeSerializer(
+            page, many=True, context=self.get_subscriptions_context(page)
         )
         return self.get_paginated_response(serializer.data)
 
+    def get_subscribed_authors(self, request):
+        """ Авторы, на которых подписан пользователь, в порядке
+        подписки: id подписки — ключ курсора.
+        """
+        return User.objects.filter(
+            subscribing__subscriber=request.user
+        ).annotate(
+            subscription_id=F('subscribing__id')
+        ).order_by('subscription_id')
+
+    def get_subscriptions_context(self, authors):
+        """ Последние рецепты всех авторов страницы выбираются
+        одним запросом и передаются сериализатору через контекст.
+        """
+        return {
+            'request': self.request,
+            'recipes': Recipe.objects.latest_by_author(
+                [author.id for author in authors],
+                get_recipes_limit(self.request),
+            ),
+        }
+
     @action(
         methods=['POST', 'DELETE'],
         detail=True,
@@ -182,9 +566,19 @@ class CustomUserViewSet(UserViewSet):
                 serializer = SubscribeSerializer(data=data,
                                                  context={'request': request})
                 if serializer.is_valid():
-                    serializer.save()
+                    with transaction.atomic():
+                        serializer.save()
+                        User.objects.filter(id=id).update(
+                            subscribers_count=F('subscribers_count') + 1
+                        )
+                    author = self.get_subscribed_authors(request).get(
+                        pk=id
+                    )
                     return Response(
-                        serializer.data,
+                        ShowSubscribeSerializer(
+                            author,
+                            context=self.get_subscriptions_context([author])
+                        ).data,
                         status=status.HTTP_201_CREATED
                     )
                 return Response(status=status.HTTP_400_BAD_REQUEST)
@@ -197,6 +591,10 @@ class CustomUserViewSet(UserViewSet):
                     subscriber=request.user.id,
                     subscribing=id
                 )
-                subscription.delete()
+                with transaction.atomic():
+                    subscription.delete()
+                    User.objects.filter(
+                        id=id, subscribers_count__gt=0
+                    ).update(subscribers_count=F('subscribers_count') - 1)
                 return Response(status=status.HTTP_204_NO_CONTENT)
             return Response(status=status.HTTP_400_BAD_REQUEST)
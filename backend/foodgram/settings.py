@@ -37,6 +37,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework',
     'django_filters',
     'rest_framework.authtoken',
@@ -64,7 +65,14 @@ REST_FRAMEWORK = {
 
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'rest_framework.authentication.TokenAuthentication',
-    ]
+    ],
+
+    # JSON с пределом длины тела DATA_UPLOAD_MAX_MEMORY_SIZE.
+    'DEFAULT_PARSER_CLASSES': [
+        'api.parsers.LimitedJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
 }
 
 
@@ -110,6 +118,31 @@ DATABASES = {
     }
 }
 
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.getenv('CACHE_LOCATION', 'foodgram'),
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+    # Версии наборов данных читают веб-процесс и меняют в том числе
+    # команды управления (importcsv, update_trending), поэтому кэш
+    # версий должен быть общим для всех процессов: по умолчанию —
+    # файловый, либо memcached/redis. Кэш в памяти процесса
+    # не допускается проверкой api.E001.
+    'versions': {
+        'BACKEND': os.getenv(
+            'VERSIONS_CACHE_BACKEND',
+            'django.core.cache.backends.filebased.FileBasedCache'
+        ),
+        'LOCATION': os.getenv(
+            'VERSIONS_CACHE_LOCATION',
+            os.path.join(BASE_DIR, 'cache', 'versions')
+        ),
+    },
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
 
@@ -175,3 +208,96 @@ EMAIL_MAX_LEN = 254
 FIRST_NAME_MAX_LEN = 150
 LAST_NAME_MAX_LEN = 150
 PASSWORD_MAX_LEN = 150
+
+# Кэш множеств id избранного, списка покупок и подписок пользователя.
+# Запись удаляет множества пользователя только в этом кэше, поэтому при
+# нескольких веб-процессах (gunicorn --workers) он должен быть общим:
+# CACHE_BACKEND и CACHE_LOCATION для memcached или redis.
+USER_FLAGS_CACHE = 'default'
+USER_FLAGS_CACHE_TIMEOUT = 60 * 60
+# Кэш версий наборов данных, общий для всех процессов.
+DATA_VERSIONS_CACHE = 'versions'
+
+# Сколько ингредиентов возвращает автодополнение по ?name=.
+INGREDIENT_SEARCH_LIMIT = 50
+# Если совпадений по началу названия нет, искать похожие по
+# триграммам в памяти процесса (для запроса отключается ?fuzzy=0).
+INGREDIENT_FUZZY_SEARCH = True
+INGREDIENT_TRIGRAM_THRESHOLD = 0.3
+# Как часто (в секундах) пересчитывать частоту ингредиентов в рецептах,
+# по которой ранжируются похожие названия, если рецепты менялись.
+INGREDIENT_USAGE_REFRESH_INTERVAL = 300
+# Как часто (в секундах) перестраивать обратный индекс «ингредиент ->
+# рецепты» для фильтров по ингредиентам, если рецепты менялись.
+RECIPE_INDEX_REFRESH_INTERVAL = 60
+
+# Загрузка изображений рецептов в base64: предел размера после
+# декодирования, предел ширины и высоты и размер куска декодирования.
+RECIPE_IMAGE_MAX_SIZE = 5 * 1024 * 1024
+RECIPE_IMAGE_MAX_DIMENSIONS = (6000, 6000)
+RECIPE_IMAGE_DECODE_CHUNK = 64 * 1024
+# Освобождённое изображение не удаляется, если его сохраняли
+# меньше стольких секунд назад: на него может сослаться рецепт
+# из ещё не зафиксированной транзакции.
+RECIPE_IMAGE_RELEASE_GRACE = 60
+
+# collect_orphan_media не трогает файлы моложе стольких секунд.
+MEDIA_ORPHAN_GRACE_PERIOD = 24 * 60 * 60
+
+# Предел тела запроса. Django применяет его к формам, а к JSON API —
+# api.parsers.LimitedJSONParser: JSONParser читает поток напрямую, мимо
+# проверки Django. Изображение рецепта в base64 длиннее исходного файла
+# на треть, плюс остальные поля рецепта; размер самого изображения
+# после декодирования ограничивает RECIPE_IMAGE_MAX_SIZE.
+DATA_UPLOAD_MAX_MEMORY_SIZE = RECIPE_IMAGE_MAX_SIZE * 4 // 3 + 1024 * 1024
+
+# Пакетное создание рецептов /api/recipes/batch/. Пакет разбирается
+# в памяти целиком, поэтому предел тела — RECIPE_BATCH_MAX_SIZE рецептов
+# по RECIPE_BATCH_ITEM_SIZE в среднем (поля рецепта и сжатое фото
+# в base64): 6,25 МБ, в пределах client_max_body_size /api/ в nginx.
+# Рецепты с крупными изображениями отправляются меньшими пакетами или
+# по одному.
+RECIPE_BATCH_MAX_SIZE = 100
+RECIPE_BATCH_ITEM_SIZE = 64 * 1024
+RECIPE_BATCH_MAX_BODY_SIZE = RECIPE_BATCH_MAX_SIZE * RECIPE_BATCH_ITEM_SIZE
+
+# Миниатюры изображений рецептов: имя -> параметры sorl get_thumbnail.
+RECIPE_THUMBNAILS = {
+    'card': {'geometry_string': '480x270', 'crop': 'center', 'quality': 80},
+    'detail': {'geometry_string': '1200', 'quality': 85},
+}
+RECIPE_THUMBNAIL_WORKERS = int(os.getenv('RECIPE_THUMBNAIL_WORKERS', 2))
+# False — откладывать миниатюры до thumbnail_pool.wait() и готовить
+# их в вызывающем потоке (для прогонов на SQLite в памяти, которая
+# не допускает записи из нескольких потоков).
+RECIPE_THUMBNAILS_ASYNC = True
+
+# Похожие рецепты (команда build_similar_recipes): сколько хранить
+# для рецепта, вес тега относительно ингредиента и порог, выше
+# которого ингредиент слишком частый, чтобы подбирать по нему кандидатов.
+SIMILAR_RECIPES_TOP_K = 10
+SIMILAR_RECIPES_TAG_WEIGHT = 0.5
+SIMILAR_RECIPES_MAX_POSTINGS = 5000
+
+# Популярные рецепты (команда update_trending): вес добавления
+# уменьшается вдвое за TRENDING_HALF_LIFE_HOURS, учитываются добавления
+# за TRENDING_WINDOW_DAYS дней.
+TRENDING_HALF_LIFE_HOURS = 72
+TRENDING_WINDOW_DAYS = 30
+TRENDING_WEIGHTS = {'favourites': 1.0, 'shopping_cart': 0.5}
+
+# Лента подписок /api/recipes/feed/: размер страницы по умолчанию и
+# наибольший; сколько подписок читать одним соединением и размер
+# группы авторов для слияния потоков, когда подписок больше.
+FEED_PAGE_SIZE = 6
+FEED_MAX_PAGE_SIZE = 100
+FEED_FANIN_THRESHOLD = 300
+FEED_MERGE_CHUNK_SIZE = 200
+
+# Выгрузка списка покупок.
+SHOPPING_CART_EXPORT_CHUNK_SIZE = 500
+SHOPPING_CART_PDF_WORKERS = int(os.getenv('SHOPPING_CART_PDF_WORKERS', 2))
+SHOPPING_CART_PDF_TIMEOUT = 30
+SHOPPING_CART_PDF_FONT = os.getenv(
+    'SHOPPING_CART_PDF_FONT', '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf'
+)
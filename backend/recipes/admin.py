@@ -13,10 +13,13 @@ class AmountOfIngredientInline(admin.TabularInline):
 
 class RecipeAdmin(admin.ModelAdmin):
     empty_value_display = 'отсутствует'
-    list_display = ('id', 'name', 'author', 'cooking_time')
+    list_display = ('id', 'name', 'author', 'cooking_time',
+                    'favourites_count')
+    readonly_fields = ('favourites_count', 'updated_at')
     ordering = ['name']
     search_fields = ['name', ]
     inlines = [AmountOfIngredientInline]
+    list_select_related = ('author', )
 
 
 class IngredientAdmin(admin.ModelAdmin):
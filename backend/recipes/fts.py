@@ -0,0 +1,126 @@
+""" Полнотекстовый поиск рецептов на стороне БД.
+PostgreSQL: вычисляемый столбец search_vector (tsvector, конфигурация
+russian, название весомее описания) с GIN-индексом. SQLite: внешняя
+таблица FTS5 recipes_recipe_fts, которую поддерживают триггеры на
+recipes_recipe. В остальных БД — поиск подстроки без индекса.
+SQLite пересоздаёт таблицу при части изменений схемы и теряет её
+триггеры: миграции, которые меняют recipes_recipe, вызывают
+create_sqlite_triggers заново.
+"""
+import re
+
+from django.db import connection
+from django.db.models import FloatField, Q, Value
+
+SQLITE_TRIGGERS = {
+    'recipes_recipe_fts_insert': (
+        'AFTER INSERT ON recipes_recipe BEGIN '
+        'INSERT INTO recipes_recipe_fts (rowid, name, text) '
+        'VALUES (new.id, new.name, new.text); END'
+    ),
+    'recipes_recipe_fts_delete': (
+        'AFTER DELETE ON recipes_recipe BEGIN '
+        'INSERT INTO recipes_recipe_fts (recipes_recipe_fts, rowid, name, '
+        'text) VALUES (\'delete\', old.id, old.name, old.text); END'
+    ),
+    'recipes_recipe_fts_update': (
+        'AFTER UPDATE OF name, text ON recipes_recipe BEGIN '
+        'INSERT INTO recipes_recipe_fts (recipes_recipe_fts, rowid, name, '
+        'text) VALUES (\'delete\', old.id, old.name, old.text); '
+        'INSERT INTO recipes_recipe_fts (rowid, name, text) '
+        'VALUES (new.id, new.name, new.text); END'
+    ),
+}
+
+
+def create_sqlite_triggers(schema_editor):
+    """ Триггеры FTS5 и перестроение индекса по текущим данным. """
+    for name, body in SQLITE_TRIGGERS.items():
+        schema_editor.execute(f'DROP TRIGGER IF EXISTS {name}')
+        schema_editor.execute(f'CREATE TRIGGER {name} {body}')
+    schema_editor.execute(
+        "INSERT INTO recipes_recipe_fts (recipes_recipe_fts) "
+        "VALUES ('rebuild')"
+    )
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute(
+            "ALTER TABLE recipes_recipe ADD COLUMN search_vector tsvector "
+            "GENERATED ALWAYS AS ("
+            "setweight(to_tsvector('russian', coalesce(name, '')), 'A') || "
+            "setweight(to_tsvector('russian', coalesce(text, '')), 'B')"
+            ") STORED"
+        )
+        schema_editor.execute(
+            'CREATE INDEX recipes_recipe_search_vector '
+            'ON recipes_recipe USING gin (search_vector)'
+        )
+    elif vendor == 'sqlite':
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE recipes_recipe_fts USING fts5("
+            "name, text, content='recipes_recipe', content_rowid='id', "
+            "tokenize='unicode61 remove_diacritics 2')"
+        )
+        create_sqlite_triggers(schema_editor)
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute(
+            'ALTER TABLE recipes_recipe DROP COLUMN IF EXISTS search_vector'
+        )
+    elif vendor == 'sqlite':
+        for name in SQLITE_TRIGGERS:
+            schema_editor.execute(f'DROP TRIGGER IF EXISTS {name}')
+        schema_editor.execute('DROP TABLE IF EXISTS recipes_recipe_fts')
+
+
+def fts5_query(text):
+    """ Запрос FTS5 из слов text: каждое слово в кавычках (операторы
+    FTS5 во вводе не действуют) и ищется как префикс, что отчасти
+    заменяет отсутствующий в SQLite русский стеммер.
+    """
+    return ' '.join(f'"{word}"*' for word in re.findall(r'\w+', text))
+
+
+def search(queryset, text):
+    """ Рецепты, подходящие под запрос text, с релевантностью
+    search_rank (больше — лучше).
+    """
+    if connection.vendor == 'postgresql':
+        query = "websearch_to_tsquery('russian', %s)"
+        return queryset.extra(
+            select={
+                'search_rank': f'ts_rank(recipes_recipe.search_vector, '
+                               f'{query})'
+            },
+            select_params=[text],
+            where=[f'recipes_recipe.search_vector @@ {query}'],
+            params=[text],
+        )
+    if connection.vendor == 'sqlite':
+        query = fts5_query(text)
+        if not query:
+            return queryset.annotate(
+                search_rank=Value(0.0, output_field=FloatField())
+            ).none()
+        # Соединение с таблицей FTS5 в одном запросе; bm25 тем меньше,
+        # чем запись релевантнее, название весит в 10 раз больше описания.
+        return queryset.extra(
+            select={
+                'search_rank': '-bm25(recipes_recipe_fts, 10.0, 1.0)'
+            },
+            tables=['recipes_recipe_fts'],
+            where=[
+                'recipes_recipe_fts.rowid = recipes_recipe.id',
+                'recipes_recipe_fts MATCH %s',
+            ],
+            params=[query],
+        )
+    return queryset.filter(
+        Q(name__icontains=text) | Q(text__icontains=text)
+    ).annotate(search_rank=Value(0.0, output_field=FloatField()))
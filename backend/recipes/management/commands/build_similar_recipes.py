@@ -0,0 +1,156 @@
+import heapq
+import math
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from recipes.models import AmountOfIngredient, Recipe, SimilarRecipe
+
+
+def load_vectors(tag_weight):
+    """ Разреженные векторы рецептов {признак: вес}: ингредиент id —
+    признак id с весом 1, тег id — признак -id с весом tag_weight.
+    """
+    vectors = defaultdict(dict)
+    for recipe_id, ingredient_id in AmountOfIngredient.objects.values_list(
+        'recipe_id', 'ingredient_id'
+    ).iterator():
+        vectors[recipe_id][ingredient_id] = 1.0
+    for recipe_id, tag_id in Recipe.tags.through.objects.values_list(
+        'recipe_id', 'tag_id'
+    ).iterator():
+        if recipe_id in vectors:
+            vectors[recipe_id][-tag_id] = tag_weight
+    return vectors
+
+
+class Similarity:
+    """ Косинусное сходство по обратному индексу: кандидаты — рецепты
+    с общим ингредиентом, поэтому попарно сравниваются только они.
+    Ингредиенты, которые есть больше чем в max_postings рецептах (соль,
+    вода), кандидатов не дают, но в сходстве учитываются.
+    """
+
+    def __init__(self, vectors, max_postings):
+        self.vectors = vectors
+        self.norms = {
+            recipe_id: math.sqrt(sum(weight * weight
+                                     for weight in vector.values()))
+            for recipe_id, vector in vectors.items()
+        }
+        postings = defaultdict(list)
+        for recipe_id, vector in vectors.items():
+            for feature in vector:
+                if feature > 0:
+                    postings[feature].append(recipe_id)
+        self.postings = {
+            feature: recipe_ids for feature, recipe_ids in postings.items()
+            if len(recipe_ids) <= max_postings
+        }
+
+    def candidates(self, recipe_id):
+        result = set()
+        for feature in self.vectors.get(recipe_id, ()):
+            result.update(self.postings.get(feature, ()))
+        result.discard(recipe_id)
+        return result
+
+    def top(self, recipe_id, k):
+        """ k пар (сходство, id) с наибольшим сходством. """
+        vector = self.vectors[recipe_id]
+        norm = self.norms[recipe_id]
+        scored = []
+        for other_id in self.candidates(recipe_id):
+            other = self.vectors[other_id]
+            dot = sum(
+                weight * other[feature]
+                for feature, weight in vector.items() if feature in other
+            )
+            scored.append((dot / (norm * self.norms[other_id]), other_id))
+        return heapq.nlargest(k, scored)
+
+
+class Command(BaseCommand):
+    help = (
+        'Считает похожие рецепты по общим ингредиентам и тегам и хранит '
+        'SIMILAR_RECIPES_TOP_K ближайших для каждого рецепта. По умолчанию '
+        'пересчитывает только рецепты, изменённые с прошлого запуска, '
+        'и рецепты, связанные с ними.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full', action='store_true',
+            help='Пересчитать все рецепты.'
+        )
+        parser.add_argument(
+            '--top-k', type=int, default=settings.SIMILAR_RECIPES_TOP_K,
+            help='Сколько похожих рецептов хранить для каждого рецепта.'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='Для скольких рецептов записывать результат за раз.'
+        )
+
+    def handle(self, *args, **options):
+        if options['top_k'] < 1 or options['batch_size'] < 1:
+            raise CommandError(
+                '--top-k и --batch-size должны быть положительными.'
+            )
+        started = timezone.now()
+        similarity = Similarity(
+            load_vectors(settings.SIMILAR_RECIPES_TAG_WEIGHT),
+            settings.SIMILAR_RECIPES_MAX_POSTINGS,
+        )
+        since = SimilarRecipe.objects.aggregate(
+            last=Max('computed_at')
+        )['last']
+        full = options['full'] or since is None
+        if full:
+            targets = set(similarity.vectors)
+        else:
+            targets = self.affected(similarity, since)
+        targets = sorted(targets)
+        written = 0
+        for start in range(0, len(targets), options['batch_size']):
+            batch = targets[start:start + options['batch_size']]
+            rows = [
+                SimilarRecipe(
+                    recipe_id=recipe_id, similar_id=other_id,
+                    score=score, computed_at=started,
+                )
+                for recipe_id in batch if recipe_id in similarity.vectors
+                for score, other_id in similarity.top(
+                    recipe_id, options['top_k']
+                )
+            ]
+            with transaction.atomic():
+                SimilarRecipe.objects.filter(recipe_id__in=batch).delete()
+                SimilarRecipe.objects.bulk_create(rows)
+            written += len(rows)
+        if full:
+            # Рецепты, у которых не осталось ингредиентов.
+            SimilarRecipe.objects.filter(computed_at__lt=started).delete()
+        self.stdout.write(
+            f'{"Полный" if full else "Частичный"} пересчёт: рецептов - '
+            f'{len(targets)}, записано похожих - {written}.'
+        )
+
+    def affected(self, similarity, since):
+        """ Изменённые рецепты, рецепты с общими с ними ингредиентами
+        и рецепты, в чьих списках изменённые уже были.
+        """
+        changed = set(Recipe.objects.filter(
+            updated_at__gte=since
+        ).values_list('id', flat=True))
+        result = set(changed)
+        for recipe_id in changed:
+            result.update(similarity.candidates(recipe_id))
+        result.update(SimilarRecipe.objects.filter(
+            similar_id__in=changed
+        ).values_list('recipe_id', flat=True))
+        return result
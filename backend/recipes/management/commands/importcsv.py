@@ -1,49 +1,202 @@
 import csv
+import io
+import json
 import os
+from itertools import islice
 
 from django.conf import settings
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from api.cache import INGREDIENTS, bump_version
 from recipes.models import Ingredient
 
+DEFAULT_PATH = os.path.join(settings.BASE_DIR, 'recipes/data/ingredients.csv')
+FORMATS = ('csv', 'json')
+CHUNK_SIZE = 64 * 1024
+MAX_LENGTH = 200
+
+
+def read_csv(file):
+    """ Строки CSV без заголовка: название, единица измерения. """
+    for row in csv.reader(file, delimiter=','):
+        if len(row) != 2:
+            yield None
+            continue
+        yield row
+
+
+def read_json(file):
+    """ Элементы JSON-массива по одному, без чтения файла целиком. """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    started = False
+    while True:
+        chunk = file.read(CHUNK_SIZE)
+        buffer = buffer[position:] + chunk
+        position = 0
+        while True:
+            while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                position += 1
+            if not started:
+                if position == len(buffer):
+                    break
+                if buffer[position] != '[':
+                    raise CommandError('Ожидается JSON-массив ингредиентов.')
+                started = True
+                position += 1
+                continue
+            if position < len(buffer) and buffer[position] == ']':
+                return
+            try:
+                item, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                # Элемент не поместился в прочитанный кусок.
+                break
+            position = end
+            if not isinstance(item, dict):
+                yield None
+                continue
+            yield item.get('name'), item.get('measurement_unit')
+        if not chunk:
+            raise CommandError('JSON-массив ингредиентов оборван.')
+
 
-def get_reader(file_name: str):
-    # csv_path = os.path.join(settings.BASE_DIR, '../data/', file_name)
-    csv_path = os.path.join(settings.BASE_DIR, 'recipes/data/', file_name)
-    csv_file = open(csv_path, 'r', encoding='utf-8')
-    reader = csv.reader(csv_file, delimiter=',')
-    return reader
+def clean(rows, stats):
+    """ Пропускает пустые и слишком длинные значения. """
+    for row in rows:
+        stats['read'] += 1
+        if row is None:
+            stats['skipped'] += 1
+            continue
+        name, measurement_unit = row
+        if not isinstance(name, str) or not isinstance(measurement_unit, str):
+            stats['skipped'] += 1
+            continue
+        name, measurement_unit = name.strip(), measurement_unit.strip()
+        if (not name or not measurement_unit
+                or len(name) > MAX_LENGTH
+                or len(measurement_unit) > MAX_LENGTH):
+            stats['skipped'] += 1
+            continue
+        yield name, measurement_unit
+
+
+def batches(rows, size):
+    rows = iter(rows)
+    while True:
+        batch = list(dict.fromkeys(islice(rows, size)))
+        if not batch:
+            return
+        yield batch
 
 
 class Command(BaseCommand):
+    help = (
+        'Загружает ингредиенты из CSV (без заголовка: название, единица '
+        'измерения) или из JSON-массива. Файл читается потоком, строки '
+        'вставляются пакетами; уже существующие ингредиенты пропускаются.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path', nargs='?', default=DEFAULT_PATH,
+            help='Файл с ингредиентами.'
+        )
+        parser.add_argument(
+            '--format', choices=FORMATS,
+            help='Формат файла; по умолчанию — по расширению.'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Сколько строк вставлять одним запросом.'
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Выполнить загрузку и откатить транзакцию.'
+        )
+        parser.add_argument(
+            '--summary-only', action='store_true',
+            help='Не выводить прогресс по пакетам, только итог.'
+        )
 
     def handle(self, *args, **options):
-        csv_reader = get_reader('ingredients.csv')
-        next(csv_reader, None)
-        number = 0
-        load_count = 0
-        for row in csv_reader:
-            number += 1
-            name_value, measurement_unit_value = row
-            if Ingredient.objects.filter(
-                name=name_value,
-                measurement_unit=measurement_unit_value
-            ).exists():
-                print(f'{number}) Ингредиент "{name_value.capitalize()}" '
-                      f'с мерой измерения "{measurement_unit_value}" '
-                      f'уже имеется в базе данных.')
-                continue
+        path = options['path']
+        file_format = options['format'] or os.path.splitext(path)[1][1:]
+        if file_format not in FORMATS:
+            raise CommandError(
+                f'Формат файла должен быть одним из: {", ".join(FORMATS)}.'
+            )
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size должен быть положительным.')
+        self.verbose = not options['summary_only']
+        stats = {'read': 0, 'skipped': 0, 'created': 0}
+        reader = read_csv if file_format == 'csv' else read_json
+        with open(path, encoding='utf-8', newline='') as file, \
+                transaction.atomic():
+            rows = clean(reader(file), stats)
+            if connection.vendor == 'postgresql':
+                self.load_with_copy(rows, options['batch_size'], stats)
             else:
-                Ingredient.objects.get_or_create(
-                    name=name_value,
-                    measurement_unit=measurement_unit_value
+                self.load_with_bulk_create(rows, options['batch_size'], stats)
+            if options['dry_run']:
+                transaction.set_rollback(True)
+        if stats['created'] and not options['dry_run']:
+            bump_version(INGREDIENTS)
+        self.stdout.write(
+            f'Загрузка из {os.path.basename(path)} '
+            f'{"проверена (без записи)" if options["dry_run"] else "завершена"}.'
+            f' Прочитано строк - {stats["read"]}, пропущено - '
+            f'{stats["skipped"]}, новых ингредиентов - {stats["created"]}.'
+            f' Всего в базе данных {Ingredient.objects.count()}'
+            f' записей ингредиентов.'
+        )
+
+    def progress(self, number, stats):
+        if self.verbose:
+            self.stdout.write(
+                f'Пакет {number}: прочитано строк - {stats["read"]}.'
+            )
+
+    def load_with_bulk_create(self, rows, batch_size, stats):
+        before = Ingredient.objects.count()
+        for number, batch in enumerate(batches(rows, batch_size), 1):
+            Ingredient.objects.bulk_create(
+                (
+                    Ingredient(name=name, measurement_unit=measurement_unit)
+                    for name, measurement_unit in batch
+                ),
+                ignore_conflicts=True,
+            )
+            self.progress(number, stats)
+        stats['created'] = Ingredient.objects.count() - before
+
+    def load_with_copy(self, rows, batch_size, stats):
+        """ COPY во временную таблицу и одна вставка из неё
+        с пропуском конфликтов по ingredient_unique.
+        """
+        table = Ingredient._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'CREATE TEMPORARY TABLE ingredient_import '
+                '(name varchar(200), measurement_unit varchar(200)) '
+                'ON COMMIT DROP'
+            )
+            for number, batch in enumerate(batches(rows, batch_size), 1):
+                buffer = io.StringIO()
+                csv.writer(buffer).writerows(batch)
+                buffer.seek(0)
+                cursor.copy_expert(
+                    'COPY ingredient_import (name, measurement_unit) '
+                    'FROM STDIN WITH (FORMAT csv)',
+                    buffer
                 )
-                load_count += 1
-                print(f'{number}) Ингредиент "{name_value.capitalize()}" '
-                      f'с мерой измерения "{measurement_unit_value}" '
-                      f'помещен в базу данных.')
-
-        ingredients_count = Ingredient.objects.all().count()
-        print(f'Загрузка данных из ingredients.csv завершена.'
-              f' Загружено ингредиентов - {load_count}.'
-              f' Всего в базе данных {ingredients_count}'
-              f' записей ингредиентов.')
+                self.progress(number, stats)
+            cursor.execute(
+                f'INSERT INTO {table} (name, measurement_unit) '
+                f'SELECT DISTINCT name, measurement_unit '
+                f'FROM ingredient_import '
+                f'ON CONFLICT (name, measurement_unit) DO NOTHING'
+            )
+            stats['created'] = cursor.rowcount
@@ -0,0 +1,70 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from recipes.models import Favourite, Recipe
+from users.models import Subscribe, User
+
+
+def count_of(model, field):
+    """ Подзапрос: число строк model, ссылающихся на текущую запись. """
+    return Coalesce(Subquery(
+        model.objects.filter(**{field: OuterRef('pk')}).order_by().values(
+            field
+        ).annotate(total=Count('id')).values('total')
+    ), 0)
+
+
+COUNTERS = (
+    (Recipe, 'favourites_count', Favourite, 'recipe'),
+    (User, 'recipes_count', Recipe, 'author'),
+    (User, 'subscribers_count', Subscribe, 'subscribing'),
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересчитывает счётчики избранного, рецептов и подписчиков '
+        'одним UPDATE на каждый счётчик. С --verify только проверяет их.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify', action='store_true',
+            help='Только сравнить счётчики с реальными данными.'
+        )
+
+    def handle(self, *args, **options):
+        if options['verify']:
+            self.verify()
+        else:
+            self.rebuild()
+
+    @transaction.atomic
+    def rebuild(self):
+        for model, counter, source, field in COUNTERS:
+            updated = model.objects.update(
+                **{counter: count_of(source, field)}
+            )
+            self.stdout.write(
+                f'{model._meta.verbose_name_plural}.{counter}: '
+                f'пересчитано записей - {updated}.'
+            )
+
+    def verify(self):
+        broken = 0
+        for model, counter, source, field in COUNTERS:
+            wrong = model.objects.annotate(
+                actual=count_of(source, field)
+            ).exclude(**{counter: F('actual')}).count()
+            broken += wrong
+            self.stdout.write(
+                f'{model._meta.verbose_name_plural}.{counter}: '
+                f'расхождений - {wrong}.'
+            )
+        if broken:
+            raise CommandError(
+                'Счётчики расходятся с данными, '
+                'запустите rebuild_counters без --verify.'
+            )
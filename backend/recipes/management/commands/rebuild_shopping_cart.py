@@ -0,0 +1,72 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Sum
+
+from recipes.models import AmountOfIngredient, ShoppingCartIngredient
+
+
+def actual_totals():
+    """ Суммы ингредиентов по спискам покупок, посчитанные заново. """
+    return AmountOfIngredient.objects.filter(
+        recipe__shopping_list__isnull=False
+    ).values_list(
+        'recipe__shopping_list__user', 'ingredient'
+    ).annotate(total=Sum('amount')).order_by().iterator()
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересчитывает суммы ингредиентов в списках покупок из рецептов. '
+        'С --verify только проверяет их.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify', action='store_true',
+            help='Только сравнить суммы с реальными данными.'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Сколько строк вставлять одним запросом.'
+        )
+
+    def handle(self, *args, **options):
+        if options['verify']:
+            self.verify()
+        else:
+            self.rebuild(options['batch_size'])
+
+    @transaction.atomic
+    def rebuild(self, batch_size):
+        ShoppingCartIngredient.objects.all().delete()
+        created = ShoppingCartIngredient.objects.bulk_create(
+            (
+                ShoppingCartIngredient(
+                    user_id=user_id, ingredient_id=ingredient_id,
+                    amount=amount
+                )
+                for user_id, ingredient_id, amount in actual_totals()
+            ),
+            batch_size=batch_size,
+        )
+        self.stdout.write(f'Пересчитано сумм - {len(created)}.')
+
+    def verify(self):
+        stored = {
+            (user_id, ingredient_id): amount
+            for user_id, ingredient_id, amount
+            in ShoppingCartIngredient.objects.values_list(
+                'user_id', 'ingredient_id', 'amount'
+            ).iterator()
+        }
+        wrong = 0
+        for user_id, ingredient_id, amount in actual_totals():
+            if stored.pop((user_id, ingredient_id), None) != amount:
+                wrong += 1
+        wrong += len(stored)
+        self.stdout.write(f'Расхождений - {wrong}.')
+        if wrong:
+            raise CommandError(
+                'Суммы расходятся с данными, '
+                'запустите rebuild_shopping_cart без --verify.'
+            )
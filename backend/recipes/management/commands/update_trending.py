@@ -0,0 +1,90 @@
+import math
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count
+from django.db.models.functions import TruncHour
+from django.utils import timezone
+
+from recipes.models import Favourite, RecipeTrend, ShoppingList
+
+EVENTS = {
+    'favourites': Favourite,
+    'shopping_cart': ShoppingList,
+}
+
+
+def decayed_scores(now, half_life, window, weights):
+    """ Сумма весов добавлений за окно window, каждое добавление
+    теряет половину веса за half_life. События группируются в БД
+    по часам, поэтому строк в ответе не больше, чем пар
+    (рецепт, час), а не событий.
+    """
+    rate = math.log(2) / half_life.total_seconds()
+    scores = defaultdict(float)
+    for kind, model in EVENTS.items():
+        weight = weights[kind]
+        if not weight:
+            continue
+        buckets = model.objects.filter(
+            created__gte=now - window
+        ).annotate(hour=TruncHour('created')).values_list(
+            'recipe_id', 'hour'
+        ).annotate(events=Count('id')).order_by().iterator()
+        for recipe_id, hour, events in buckets:
+            age = max((now - hour).total_seconds(), 0)
+            scores[recipe_id] += weight * events * math.exp(-rate * age)
+    return scores
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересчитывает популярность рецептов по добавлениям в избранное '
+        'и в список покупок с затуханием по времени. Запускается '
+        'периодически, например раз в час.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--half-life', type=float,
+            default=settings.TRENDING_HALF_LIFE_HOURS,
+            help='За сколько часов вес добавления уменьшается вдвое.'
+        )
+        parser.add_argument(
+            '--window', type=float, default=settings.TRENDING_WINDOW_DAYS,
+            help='За сколько последних дней учитывать добавления.'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Сколько строк вставлять одним запросом.'
+        )
+
+    def handle(self, *args, **options):
+        if options['half_life'] <= 0 or options['window'] <= 0:
+            raise CommandError(
+                '--half-life и --window должны быть положительными.'
+            )
+        now = timezone.now()
+        scores = decayed_scores(
+            now,
+            timedelta(hours=options['half_life']),
+            timedelta(days=options['window']),
+            settings.TRENDING_WEIGHTS,
+        )
+        with transaction.atomic():
+            RecipeTrend.objects.all().delete()
+            RecipeTrend.objects.bulk_create(
+                (
+                    RecipeTrend(
+                        recipe_id=recipe_id, score=score, computed_at=now
+                    )
+                    for recipe_id, score in scores.items()
+                ),
+                batch_size=options['batch_size'],
+            )
+        self.stdout.write(
+            f'Популярность пересчитана: рецептов - {len(scores)}.'
+        )
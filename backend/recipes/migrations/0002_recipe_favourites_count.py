@@ -0,0 +1,31 @@
+# Generated by Django 3.2.18 on 2026-10-18 18:09
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_favourites_count(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    Favourite = apps.get_model('recipes', 'Favourite')
+    Recipe.objects.update(favourites_count=Coalesce(Subquery(
+        Favourite.objects.filter(recipe=OuterRef('pk')).order_by().values(
+            'recipe'
+        ).annotate(total=Count('id')).values('total')
+    ), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='favourites_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Добавлений в избранное'),
+        ),
+        migrations.RunPython(fill_favourites_count, migrations.RunPython.noop),
+    ]
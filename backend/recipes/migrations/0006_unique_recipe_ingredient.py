@@ -0,0 +1,42 @@
+# Generated by Django 3.2.18 on 2026-10-18 19:05
+
+from django.db import migrations, models
+
+
+def merge_duplicate_amounts(apps, schema_editor):
+    """ Повторы ингредиента в одном рецепте сливаются в одну строку
+    с суммарным количеством.
+    """
+    AmountOfIngredient = apps.get_model('recipes', 'AmountOfIngredient')
+    duplicates = AmountOfIngredient.objects.values(
+        'recipe', 'ingredient'
+    ).annotate(
+        rows=models.Count('id'), total=models.Sum('amount')
+    ).filter(rows__gt=1).order_by()
+    for duplicate in duplicates:
+        amounts = AmountOfIngredient.objects.filter(
+            recipe=duplicate['recipe'], ingredient=duplicate['ingredient']
+        ).order_by('id')
+        kept = amounts.first()
+        amounts.exclude(id=kept.id).delete()
+        kept.amount = duplicate['total']
+        kept.save(update_fields=('amount', ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0005_shoppingcartingredient'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='amountofingredient',
+            name='unique_ingredient_amount',
+        ),
+        migrations.RunPython(merge_duplicate_amounts, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='amountofingredient',
+            constraint=models.UniqueConstraint(fields=('recipe', 'ingredient'), name='unique_recipe_ingredient'),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 3.2.18 on 2026-10-18 20:10
+
+from django.db import migrations, models
+
+import recipes.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0007_recipe_thumbnails'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='recipe',
+            name='image',
+            field=models.ImageField(blank=True, default=None, null=True, storage=recipes.storage.ContentAddressedStorage(), upload_to='recipes/images/', verbose_name='Изображение'),
+        ),
+    ]
@@ -0,0 +1,20 @@
+from django.db import migrations
+
+from recipes import fts
+
+
+class Migration(migrations.Migration):
+    """ Полнотекстовый поиск рецептов по названию и описанию.
+    PostgreSQL: вычисляемый столбец tsvector (конфигурация russian,
+    название весомее описания) с GIN-индексом. SQLite: таблица FTS5
+    над recipes_recipe, которую поддерживают триггеры.
+    Столбцы не описаны в модели: запросы строит RecipeQuerySet.search.
+    """
+
+    dependencies = [
+        ('recipes', '0008_recipe_image_content_addressed'),
+    ]
+
+    operations = [
+        migrations.RunPython(fts.create_search_index, fts.drop_search_index),
+    ]
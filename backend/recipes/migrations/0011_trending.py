@@ -0,0 +1,43 @@
+# Generated by Django 3.2.18 on 2026-10-18 21:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0010_similarrecipe'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='favourite',
+            name='created',
+            field=models.DateTimeField(auto_now_add=True, db_index=True, default=django.utils.timezone.now, verbose_name='Дата добавления'),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='shoppinglist',
+            name='created',
+            field=models.DateTimeField(auto_now_add=True, db_index=True, default=django.utils.timezone.now, verbose_name='Дата добавления'),
+            preserve_default=False,
+        ),
+        migrations.CreateModel(
+            name='RecipeTrend',
+            fields=[
+                ('recipe', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='trend', serialize=False, to='recipes.recipe', verbose_name='Рецепт')),
+                ('score', models.FloatField(verbose_name='Популярность')),
+                ('computed_at', models.DateTimeField(verbose_name='Дата расчёта')),
+            ],
+            options={
+                'verbose_name': 'Популярность рецепта',
+                'verbose_name_plural': 'Популярность рецептов',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='recipetrend',
+            index=models.Index(fields=['-score', '-recipe'], name='recipe_trend_score'),
+        ),
+    ]
@@ -0,0 +1,77 @@
+# Generated by Django 3.2.18 on 2026-10-18 22:10
+
+from django.db import migrations, models
+from django.db.models import Count, Min, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def delete_duplicates(model):
+    """ Оставляет по одной (самой ранней) строке на пару
+    (пользователь, рецепт); возвращает затронутые пары.
+    """
+    duplicates = list(model.objects.values('user', 'recipe').annotate(
+        rows=Count('id'), first=Min('id')
+    ).filter(rows__gt=1).order_by())
+    for duplicate in duplicates:
+        model.objects.filter(
+            user=duplicate['user'], recipe=duplicate['recipe']
+        ).exclude(id=duplicate['first']).delete()
+    return duplicates
+
+
+def merge_duplicates(apps, schema_editor):
+    """ Повторы в избранном и в списке покупок удаляются, счётчики
+    избранного и суммы списков покупок затронутых пользователей
+    пересчитываются.
+    """
+    Recipe = apps.get_model('recipes', 'Recipe')
+    Favourite = apps.get_model('recipes', 'Favourite')
+    ShoppingList = apps.get_model('recipes', 'ShoppingList')
+    AmountOfIngredient = apps.get_model('recipes', 'AmountOfIngredient')
+    ShoppingCartIngredient = apps.get_model(
+        'recipes', 'ShoppingCartIngredient'
+    )
+    recipes = {row['recipe'] for row in delete_duplicates(Favourite)}
+    if recipes:
+        Recipe.objects.filter(id__in=recipes).update(
+            favourites_count=Coalesce(Subquery(
+                Favourite.objects.filter(
+                    recipe=OuterRef('pk')
+                ).order_by().values('recipe').annotate(
+                    total=Count('id')
+                ).values('total')
+            ), 0)
+        )
+    users = {row['user'] for row in delete_duplicates(ShoppingList)}
+    if users:
+        ShoppingCartIngredient.objects.filter(user__in=users).delete()
+        ShoppingCartIngredient.objects.bulk_create(
+            ShoppingCartIngredient(
+                user_id=user_id, ingredient_id=ingredient_id, amount=amount
+            )
+            for user_id, ingredient_id, amount
+            in AmountOfIngredient.objects.filter(
+                recipe__shopping_list__user__in=users
+            ).values_list(
+                'recipe__shopping_list__user', 'ingredient'
+            ).annotate(total=Sum('amount')).order_by()
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0012_recipe_author_id_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='favourite',
+            constraint=models.UniqueConstraint(fields=('user', 'recipe'), name='unique_favourite'),
+        ),
+        migrations.AddConstraint(
+            model_name='shoppinglist',
+            constraint=models.UniqueConstraint(fields=('user', 'recipe'), name='unique_shopping_list'),
+        ),
+    ]
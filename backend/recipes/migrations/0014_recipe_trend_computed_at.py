@@ -0,0 +1,17 @@
+# Generated by Django 3.2.18 on 2026-10-18 19:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0013_unique_favourite_shopping_list'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='recipetrend',
+            index=models.Index(fields=['computed_at'], name='recipe_trend_computed_at'),
+        ),
+    ]
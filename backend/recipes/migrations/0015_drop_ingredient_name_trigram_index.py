@@ -0,0 +1,30 @@
+from django.db import migrations
+
+
+def drop_trigram_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS recipes_ingredient_name_trgm')
+
+
+def create_trigram_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS recipes_ingredient_name_trgm '
+        'ON recipes_ingredient USING gin (name gin_trgm_ops)'
+    )
+
+
+class Migration(migrations.Migration):
+    """ Похожие ингредиенты ищутся по индексу в памяти во всех БД,
+    GIN-индекс pg_trgm больше не используется.
+    """
+
+    dependencies = [
+        ('recipes', '0014_recipe_trend_computed_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_trigram_index, create_trigram_index),
+    ]
@@ -1,10 +1,64 @@
 from django.core.validators import MinValueValidator, RegexValidator
 from django.db import models
-from django.db.models import UniqueConstraint
+from django.db.models import (Case, F, Prefetch, UniqueConstraint, Value, When,
+                              Window)
+from django.db.models.functions import Greatest, RowNumber
 
+from recipes import fts
+from recipes.storage import ContentAddressedStorage
 from users.models import User
 
 
+class RecipeQuerySet(models.QuerySet):
+
+    def with_related(self):
+        """ Рецепты вместе с автором, тегами и ингредиентами:
+        страница рецептов обходится постоянным числом запросов.
+        """
+        return self.select_related('author').prefetch_related(
+            'tags',
+            Prefetch(
+                'ingredients',
+                queryset=AmountOfIngredient.objects.select_related(
+                    'ingredient'
+                )
+            )
+        )
+
+    def search(self, text):
+        """ Полнотекстовый поиск по названию и описанию;
+        релевантность — в search_rank.
+        """
+        return fts.search(self, text)
+
+    def latest_by_author(self, author_ids, limit=None):
+        """ Последние рецепты нескольких авторов одним запросом.
+        Возвращает словарь {id автора: [рецепты]}. При заданном лимите
+        рецепты нумеруются оконной функцией ROW_NUMBER внутри автора
+        и отбираются первые limit штук каждого.
+        """
+        queryset = self.filter(author_id__in=author_ids)
+        if limit is not None:
+            numbered = queryset.order_by().annotate(
+                row_number=Window(
+                    expression=RowNumber(),
+                    partition_by=[F('author_id')],
+                    order_by=F('id').desc(),
+                )
+            )
+            sql, params = numbered.query.sql_with_params()
+            queryset = self.raw(
+                f'SELECT * FROM ({sql}) AS numbered '
+                f'WHERE numbered.row_number <= %s '
+                f'ORDER BY numbered.id DESC',
+                (*params, limit)
+            )
+        recipes = {author_id: [] for author_id in author_ids}
+        for recipe in queryset:
+            recipes[recipe.author_id].append(recipe)
+        return recipes
+
+
 class Recipe(models.Model):
     """ Рецепты. Основная модель."""
     name = models.CharField(
@@ -42,15 +96,41 @@ class Recipe(models.Model):
     image = models.ImageField(
         'Изображение',
         upload_to='recipes/images/',
+        storage=ContentAddressedStorage(),
         blank=True,
         null=True,
         default=None,
     )
+    favourites_count = models.PositiveIntegerField(
+        'Добавлений в избранное',
+        default=0,
+        editable=False,
+    )
+    thumbnails = models.JSONField(
+        'Миниатюры',
+        default=dict,
+        blank=True,
+        editable=False,
+    )
+    updated_at = models.DateTimeField(
+        'Дата изменения',
+        auto_now=True,
+        db_index=True,
+    )
+
+    objects = RecipeQuerySet.as_manager()
 
     class Meta:
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
         ordering = ['-id']
+        indexes = (
+            # Последние рецепты автора: профиль, подписки и лента.
+            models.Index(
+                fields=('author', '-id'),
+                name='recipe_author_id',
+            ),
+        )
 
     def __str__(self):
         return self.name
@@ -117,8 +197,8 @@ class AmountOfIngredient(models.Model):
         verbose_name_plural = 'Количество ингредиентов'
         constraints = (
             UniqueConstraint(
-                fields=('ingredient', 'amount',),
-                name='unique_ingredient_amount',
+                fields=('recipe', 'ingredient'),
+                name='unique_recipe_ingredient',
             ),
         )
 
@@ -178,10 +258,23 @@ class Favourite(models.Model):
         verbose_name='Пользователь',
         related_name='+',
     )
+    created = models.DateTimeField(
+        'Дата добавления',
+        auto_now_add=True,
+        db_index=True,
+    )
 
     class Meta:
         verbose_name = 'Избранные рецепты'
         verbose_name_plural = 'Избранные рецепты'
+        # Индекс ограничения (user, recipe) отвечает и на проверку
+        # «рецепт уже добавлен», и на выборку всех рецептов пользователя.
+        constraints = (
+            UniqueConstraint(
+                fields=('user', 'recipe'),
+                name='unique_favourite',
+            ),
+        )
 
     def __str__(self):
         return (
@@ -203,12 +296,225 @@ class ShoppingList(models.Model):
         verbose_name='Пользователь',
         related_name='+',
     )
+    created = models.DateTimeField(
+        'Дата добавления',
+        auto_now_add=True,
+        db_index=True,
+    )
 
     class Meta:
         verbose_name = 'Список покупок'
         verbose_name_plural = 'Список покупок'
+        # Индекс ограничения (user, recipe) отвечает и на проверку
+        # «рецепт уже добавлен», и на выборку всех рецептов пользователя.
+        constraints = (
+            UniqueConstraint(
+                fields=('user', 'recipe'),
+                name='unique_shopping_list',
+            ),
+        )
 
     def __str__(self):
         return (
             f'{self.user} добавил "{self.recipe}" в Список покупок.'
         )
+
+
+class ShoppingCartQuerySet(models.QuerySet):
+
+    def apply(self, user_ids, delta):
+        """ Прибавляет delta {id ингредиента: количество} к суммам
+        пользователей user_ids. Строки с нулевой суммой удаляются.
+        Вызывается внутри транзакции, которая меняет список покупок
+        или ингредиенты рецепта.
+        Недостающие строки сначала вставляются с нулём, конфликты по
+        (user, ingredient) пропускаются; затем все суммы меняются одним
+        UPDATE с F(). Так параллельные добавления не теряют прибавки
+        и не нарушают уникальность строк.
+        """
+        delta = {key: value for key, value in delta.items() if value}
+        if not user_ids or not delta:
+            return
+        self.bulk_create(
+            [
+                self.model(
+                    user_id=user_id, ingredient_id=ingredient_id, amount=0
+                )
+                for user_id in user_ids
+                for ingredient_id, value in delta.items() if value > 0
+            ],
+            ignore_conflicts=True,
+        )
+        rows = self.filter(user_id__in=user_ids, ingredient_id__in=delta)
+        rows.update(amount=Greatest(
+            F('amount') + Case(
+                *(
+                    When(ingredient_id=ingredient_id, then=Value(value))
+                    for ingredient_id, value in delta.items()
+                ),
+                output_field=models.IntegerField(),
+            ),
+            0,
+        ))
+        if any(value < 0 for value in delta.values()):
+            rows.filter(amount=0).delete()
+
+    def add_recipe(self, user_id, recipe_id, sign=1):
+        """ Учитывает добавление (sign=1) или удаление (sign=-1)
+        рецепта из списка покупок пользователя. Строка рецепта
+        блокируется, как и при изменении его ингредиентов: количества
+        не поменяются между их чтением и записью сумм.
+        """
+        Recipe.objects.select_for_update().only('id').get(pk=recipe_id)
+        self.apply([user_id], {
+            ingredient_id: sign * amount
+            for ingredient_id, amount in recipe_totals(recipe_id).items()
+        })
+
+    def change_recipe(self, recipe_id, old_totals, new_totals):
+        """ Переносит изменение ингредиентов рецепта в суммы всех
+        пользователей, у которых рецепт в списке покупок.
+        """
+        self.apply(
+            list(ShoppingList.objects.filter(
+                recipe_id=recipe_id
+            ).values_list('user_id', flat=True)),
+            {
+                ingredient_id: (
+                    new_totals.get(ingredient_id, 0)
+                    - old_totals.get(ingredient_id, 0)
+                )
+                for ingredient_id in {*old_totals, *new_totals}
+            }
+        )
+
+
+def recipe_totals(recipe_id):
+    """ Количество каждого ингредиента в рецепте. """
+    return dict(AmountOfIngredient.objects.filter(
+        recipe_id=recipe_id
+    ).values_list('ingredient_id').annotate(
+        total=models.Sum('amount')
+    ).order_by())
+
+
+class ShoppingCartIngredient(models.Model):
+    """ Суммы ингредиентов по списку покупок пользователя.
+    Хранятся готовыми, поэтому выгрузка списка читает их по индексу,
+    а не агрегирует количества из всех рецептов корзины.
+    Обновляются в тех же транзакциях, что и список покупок и
+    ингредиенты рецептов; пересчёт — команда rebuild_shopping_cart.
+    """
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        verbose_name='Пользователь',
+        related_name='+',
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        verbose_name='Ингридиент',
+        related_name='+',
+    )
+    amount = models.PositiveIntegerField(
+        verbose_name='Количество',
+    )
+
+    objects = ShoppingCartQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'Сумма ингредиента в списке покупок'
+        verbose_name_plural = 'Суммы ингредиентов в списке покупок'
+        constraints = (
+            UniqueConstraint(
+                fields=('user', 'ingredient'),
+                name='unique_shopping_cart_ingredient',
+            ),
+        )
+
+    def __str__(self):
+        return f'{self.user}: {self.ingredient.name} - {self.amount}'
+
+
+class SimilarRecipe(models.Model):
+    """ Похожие рецепты: для каждого рецепта — до SIMILAR_RECIPES_TOP_K
+    ближайших по общим ингредиентам и тегам. Считаются заранее
+    командой build_similar_recipes; ответ API — одно чтение по индексу.
+    """
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        verbose_name='Рецепт',
+        related_name='similar_recipes',
+    )
+    similar = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        verbose_name='Похожий рецепт',
+        related_name='similar_to',
+    )
+    score = models.FloatField(
+        verbose_name='Сходство',
+    )
+    computed_at = models.DateTimeField(
+        verbose_name='Дата расчёта',
+        db_index=True,
+    )
+
+    class Meta:
+        verbose_name = 'Похожий рецепт'
+        verbose_name_plural = 'Похожие рецепты'
+        constraints = (
+            UniqueConstraint(
+                fields=('recipe', 'similar'),
+                name='unique_similar_recipe',
+            ),
+        )
+        indexes = (
+            models.Index(
+                fields=('recipe', '-score'),
+                name='similar_recipe_score',
+            ),
+        )
+
+    def __str__(self):
+        return f'{self.recipe} ~ {self.similar} ({self.score:.3f})'
+
+
+class RecipeTrend(models.Model):
+    """ Популярность рецепта: добавления в избранное и в список покупок,
+    вес которых убывает со временем. Пересчитывается периодически
+    командой update_trending; рецептов без добавлений здесь нет.
+    """
+    recipe = models.OneToOneField(
+        Recipe,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        verbose_name='Рецепт',
+        related_name='trend',
+    )
+    score = models.FloatField(
+        verbose_name='Популярность',
+    )
+    computed_at = models.DateTimeField(
+        verbose_name='Дата расчёта',
+    )
+
+    class Meta:
+        verbose_name = 'Популярность рецепта'
+        verbose_name_plural = 'Популярность рецептов'
+        indexes = (
+            models.Index(
+                fields=('-score', '-recipe'),
+                name='recipe_trend_score',
+            ),
+            # Время последнего пересчёта — версия ответа /trending/.
+            models.Index(
+                fields=('computed_at', ),
+                name='recipe_trend_computed_at',
+            ),
+        )
+
+    def __str__(self):
+        return f'{self.recipe}: {self.score:.3f}'
@@ -0,0 +1,49 @@
+""" Хранилище изображений рецептов с адресацией по содержимому.
+Файл называется sha256 своего содержимого: одинаковые изображения
+хранятся один раз, а имя файла никогда не указывает на другие данные,
+поэтому nginx отдаёт их с Cache-Control: immutable.
+"""
+import hashlib
+import os
+import uuid
+
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """ Имя файла: <каталог upload_to>/<2 символа хэша>/<хэш>.<расширение>.
+    Первые символы хэша вынесены в подкаталог, чтобы файлы не
+    собирались в одном каталоге.
+    """
+
+    def content_name(self, name, content):
+        """ Имя, под которым будет сохранено содержимое content. """
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+        digest = digest.hexdigest()
+        extension = os.path.splitext(name)[1].lower()
+        return os.path.join(
+            os.path.dirname(name), digest[:2], f'{digest}{extension}'
+        )
+
+    def get_available_name(self, name, max_length=None):
+        # Одинаковое имя означает одинаковое содержимое: суффиксы
+        # для уникальности не нужны.
+        return name
+
+    def _save(self, name, content):
+        name = self.content_name(name, content)
+        if self.exists(name):
+            # Время изменения отмечает свежую ссылку на файл: удаление
+            # освобождённых изображений не трогает недавно сохранённые.
+            os.utime(self.path(name))
+            return name
+        # Запись под временным именем и атомарная замена: параллельная
+        # загрузка того же файла перезапишет его тем же содержимым.
+        temporary = super()._save(f'{name}.{uuid.uuid4().hex}.tmp', content)
+        os.replace(self.path(temporary), self.path(name))
+        return name
@@ -5,7 +5,9 @@ from .models import Subscribe, User
 
 class UserAdmin(admin.ModelAdmin):
     empty_value_display = 'отсутствует'
-    list_display = ('username', 'first_name', 'last_name', 'email')
+    list_display = ('username', 'first_name', 'last_name', 'email',
+                    'recipes_count', 'subscribers_count')
+    readonly_fields = ('recipes_count', 'subscribers_count')
     ordering = ['username']
     search_fields = ['username', 'email']
 